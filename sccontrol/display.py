@@ -1,43 +1,54 @@
 #!/usr/bin/env python3
-from util import loadfont, circle, document, is_pi, screen_timeout
-from threading import Timer
+from util import loadfont, lazyfont, circle, document, is_pi, screen_timeout
+from render import Renderer
+from threading import Timer, Event
 import time
 import atexit
-from luma.core.interface.serial import i2c
-from luma.oled.device import sh1106
-from luma.core.render import canvas
-try:
-	from luma.emulator.device import pygame
-except ImportError:
-	pass
-try:
-	from RPi import GPIO
-	from tft import TFT24T
-	import spidev
-except (ImportError, RuntimeError):
-	pass
-from PIL import Image
+from PIL import Image, ImageDraw
+# luma, the OLED driver and the LCD's GPIO, SPI and TFT modules are
+# imported when the hardware is first used, to start up sooner
 
 
 
 def draw_bottom_button(draw, device, sidebar_width, height, text, font):
-	draw.rectangle((0,device.height-height, device.width-sidebar_width, device.height), fill="white")
+	draw.rectangle(bottom_button_box(device, sidebar_width, height), fill="white")
 	w,h = draw.textsize(text, font=font)
 	draw.text( ((device.width-sidebar_width)/2-w/2, device.height-height/2-h/2), text, font=font, fill="black" )
 
+def prerender(d, draw, *covered):
+	"""a layer drawn once by draw(c), and the mask to lay it over each frame
+	with: its lit pixels and the covered boxes"""
+	image = Image.new(d.mode, d.size)
+	draw(ImageDraw.Draw(image))
+	mask = image.convert('L').point(lambda v: 255 if v else 0, '1')
+	m = ImageDraw.Draw(mask)
+	for box in covered:
+		m.rectangle(box, fill=255)
+	return image, mask
+
+def bottom_button_box(device, sidebar_width, height):
+	return (0,device.height-height, device.width-sidebar_width, device.height)
+
 class Mock_LCD(object):
 	"""LCD imitator for development purposes"""
+
+	encodings = None # whatever Scanner prefers
+
 	def __init__(self):
 		super(Mock_LCD, self).__init__()
+		self.state=0
 	def backlight(self, onoff):
 		pass
 	def cleanup(self):
-		pass
+		self.state=0
 	def clear(self):
 		pass
-	def show(self, data):
+	def show(self, data, encoding=None):
 		image = Image.frombytes('RGB', (240,320), data, 'raw')
 		image.show()
+		self.state=1
+	def scroll(self, data, encoding=None, later=True):
+		self.show(data, encoding)
 
 class LCD(object):
 	"""TFT display"""
@@ -47,16 +58,33 @@ class LCD(object):
 	RST = 22 # if omitted, tie to +3.3V
 	LED = 12 # if omitted, tie to +3.3V
 
+	# thumbnails in the panel's own pixel format need no work here at all
+	encodings = ["rgb565", "jpeg:80", "zlib", "raw"]
+
+	# scroll neighbouring pages in. The screen starts changing sooner, but
+	# the page takes longer to arrive in all (see scbench.py scroll)
+	scroll_pages = False
+
 	def __init__(self):
 		super(LCD, self).__init__()
-		GPIO.setmode(GPIO.BOARD)
-		self.device = TFT24T(spidev.SpiDev(), GPIO, landscape=False)
+		self.device = None # set up when first turned on
 		self.state=0
 		atexit.register(self.cleanup)
 
+	def _open(self):
+		from RPi import GPIO
+		from tft import TFT24T
+		import spidev
+		GPIO.setmode(GPIO.BOARD)
+		self.gpio = GPIO
+		self.device = TFT24T(spidev.SpiDev(), GPIO, landscape=False)
+
 	def backlight(self, onoff):
 		self.device.backlite(onoff)
 	def off(self):
+		if self.device is None:
+			return
+		GPIO = self.gpio
 		try:
 			GPIO.output(self.RST, GPIO.LOW)
 		except RuntimeError:
@@ -65,8 +93,11 @@ class LCD(object):
 		else:
 			self.backlight(0)
 		finally:
+			self.device.close()
 			self.state=0
 	def on(self):
+		if self.device is None:
+			self._open()
 		self.device.initLCD(self.DC, self.RST, self.LED)
 		self.backlight(1)
 		self.state=1
@@ -76,12 +107,27 @@ class LCD(object):
 	def clear(self):
 		self.device.clear()
 
-	def show(self, data):
+	def show(self, data, encoding=None):
 		if not self.state:
 			self.on()
+		if encoding == "rgb565":
+			self.device.display_rgb565(data)
+			return
 		image = Image.frombytes('RGB', (240,320), data, 'raw').rotate(180)
 		self.device.display(image)
 
+	def scroll(self, data, encoding=None, later=True):
+		"""show a neighbouring page by scrolling it in, later pages from below"""
+		if not self.state or not self.scroll_pages:
+			self.show(data, encoding)
+			return
+		# the panel is mounted upside down: its top is the bottom of the screen
+		if encoding == "rgb565":
+			self.device.scroll_rgb565(data, from_top=later)
+			return
+		image = Image.frombytes('RGB', (240,320), data, 'raw').rotate(180)
+		self.device.scroll(image, from_top=later)
+
 class Sidebar(object):
 	"""draws the button sidebar"""
 
@@ -89,7 +135,7 @@ class Sidebar(object):
 	y=0
 	arrow_height=6
 	btn_gap=9.5
-	font = loadfont("tiny.ttf",6)
+	font = lazyfont("tiny.ttf",6)
 
 	def __init__(self,width):
 		super(Sidebar, self).__init__()
@@ -136,8 +182,8 @@ class Sidebar(object):
 class MenuPage(object):
 	"""Draws an individual Menu"""
 
-	page_font = loadfont("tiny.ttf",6)
-	menu_font = loadfont("ProggyTiny.ttf",16)
+	page_font = lazyfont("tiny.ttf",6)
+	menu_font = lazyfont("ProggyTiny.ttf",16)
 	menu_item_vpad=1 # for highlight box
 	menu_item_hpad=2 # for highlight box
 	menu_item_x=20
@@ -147,6 +193,7 @@ class MenuPage(object):
 
 	scanbtn_height=10
 	sidebar_width=20
+	layers = {} # (page class, mode, size) -> pre-rendered layer
 
 	def __init__(self, title, items, highlighted=0):
 		super(MenuPage, self).__init__()
@@ -191,6 +238,17 @@ class MenuPage(object):
 			for i,item in enumerate(self.items[self.highlighted-2:self.highlighted+2]):
 				c.text((self.menu_item_x,i*self.menu_item_vstep+self.menu_item_vstart), str(item), font=self.menu_font, fill="white")
 
+	def layer(self, d):
+		"""(image, mask) of the parts that never change, the SCAN! button and
+		sidebar, drawn once and laid over the title and items"""
+		key = (type(self), d.mode, d.size)
+		if key not in self.layers:
+			def draw(c):
+				draw_bottom_button(c, d, self.sidebar_width, self.scanbtn_height, "SCAN!", self.menu_font)
+				self.sidebar.draw(c,d,self)
+			self.layers[key] = prerender(d, draw, bottom_button_box(d, self.sidebar_width, self.scanbtn_height))
+		return self.layers[key]
+
 	def _draw_highlight_box(self,c,y):
 		_,height = c.textsize("X",font=self.menu_font)
 		c.rectangle((self.menu_item_x-self.menu_item_hpad,
@@ -200,10 +258,9 @@ class MenuPage(object):
 				outline="white")
 
 	def draw(self, c, d):
+		"""the title and items, over layer()"""
 		self._draw_title(c)
 		self._draw_items(c, d)
-		draw_bottom_button(c, d, self.sidebar_width, self.scanbtn_height, "SCAN!", self.menu_font)
-		self.sidebar.draw(c,d,self)
 
 
 class SettingPage(MenuPage):
@@ -219,19 +276,54 @@ class ProgressPage(object):
 	def __init__(self):
 		super(ProgressPage, self).__init__()
 		self.pages=[]
+		self.dropped=set() # blank pages scingest did not keep
 		self.proggy = loadfont("ProggyTiny.ttf",12)
 		self.button_font = loadfont("ProggyTiny.ttf",16)
 		self.sidebar = Sidebar(15)
 		self.selected=0
 		self.complete=False
+		self.accept_layer=None
+		self.txt=""
 		
+	def background(self, d):
+		"""the sidebar and Accept button once the scan is complete, drawn once"""
+		if not self.complete:
+			return None
+		if self.accept_layer is None:
+			self.accept_layer = Image.new(d.mode, d.size)
+			c = ImageDraw.Draw(self.accept_layer)
+			self.sidebar.draw(c,d,self)
+			draw_bottom_button(c, d, self.sidebar.width, 10, "Accept", self.button_font)
+		return self.accept_layer
+
+	def kept(self):
+		return [i for i in range(len(self.pages)) if i not in self.dropped]
+
 	def up(self):
-		self.selected = max(0, self.selected-1)
+		earlier = [i for i in self.kept() if i < self.selected]
+		if earlier:
+			self.selected = earlier[-1]
 
 	def down(self):
-		self.selected = min(self.selected+1, len(self.pages)-1)
+		later = [i for i in self.kept() if i > self.selected]
+		if later:
+			self.selected = later[0]
+
+	def drop(self, n):
+		"""page n (counting from 1) was blank and not saved"""
+		self.dropped.add(n-1)
+
+	def finish(self):
+		self.complete = True
+		if self.selected in self.dropped:
+			self.down()
 
-	def draw(self, c, d, msg):
+	def page_index(self):
+		"""selected page as numbered by scingest, which skips dropped pages"""
+		return len([i for i in self.kept() if i < self.selected])
+
+	def update(self, msg):
+		"""take in a status message from scingest, or text to show"""
 		if msg == "feed start":
 			txt = "Scanning next page..."
 		elif msg == "page fed":
@@ -245,11 +337,9 @@ class ProgressPage(object):
 			txt = "Saving Page {}".format(pagenum)
 		else:
 			txt = msg
+		self.txt = txt
 
-		if self.complete:
-			self.sidebar.draw(c,d,self)
-			draw_bottom_button(c, d, self.sidebar.width, 10, "Accept", self.button_font)
-
+	def draw(self, c, d):
 		x,y=5,5
 		xsep=20
 		ysep=20
@@ -257,46 +347,110 @@ class ProgressPage(object):
 			back = p == "b"
 			if back:
 				x -= xsep
-			document(c,x,y+(ysep if back else 0),i+1,backside=back,active=i==self.selected and self.complete)
+			document(c,x,y+(ysep if back else 0),i+1,backside=back,active=i==self.selected and self.complete,dropped=i in self.dropped)
 			x += xsep
-		if txt:
-			c.text((3,50),txt,fill="white",font=self.proggy)
+		if self.txt:
+			c.text((3,50),self.txt,fill="white",font=self.proggy)
 
 
 
 class Screen(object):
-	"""Represents the OLED scren"""
+	"""Represents the OLED scren
+
+	Drawing happens on a render thread (see Renderer); the draw_*
+	methods only ask for a frame. Hold lock while changing anything a
+	pending frame draws from; frames hold it while composing, and send
+	to the OLED after letting go.
 
-	FA = loadfont("fontawesome-webfont.ttf",25)
+	The welcome screen goes up first, then fonts are loaded and the fixed
+	screens drawn behind it, then the menu is shown and ready is set.
+	Times for each go to startup, if given.
+	"""
 
-	def __init__(self,init_menu):
+	FA = lazyfont("fontawesome-webfont.ttf",25)
+
+	def __init__(self,init_menu,device=None,startup=None):
 		super(Screen, self).__init__()
 		self.sleep_timer=None
 		self.state='OFF'
-
-		self.oled = sh1106(i2c(port=1, address=0x3C)) if is_pi() else pygame(width=128, height=64)
-		self._welcome()
-		time.sleep(1)
+		self.renderer = Renderer()
+		self.lock = self.renderer.lock
+		self.ready = Event()
+		self.startup = startup
+		self.icons = {} # icon character -> layer with just the icon
+		self.frames = {}
+
+		if device is None:
+			device = self._open()
+		self.oled = device
+		self.activate()
+		self.renderer.call(self._timed("welcome screen", self._welcome))
+		self.renderer.call(self._timed("fonts and screens", lambda: self._prerender(init_menu)))
 		self.draw_menu(init_menu)
 		atexit.register(self.cleanup)
 
+	def _open(self):
+		if not is_pi():
+			from oled import emulator
+			return emulator(width=128, height=64)
+		from luma.core.interface.serial import i2c
+		from oled import SH1106
+		return SH1106(i2c(port=1, address=0x3C))
+
+	def _timed(self, name, fn):
+		def timed():
+			start = time.time()
+			fn()
+			if self.startup is not None:
+				self.startup.add(name, time.time()-start)
+		return timed
+
 	def _welcome(self):
-		self.activate()
+		image,draw = self._blank()
+		draw.text((25,5), "Welcome",fill="white",font=loadfont("Raleway-Bold.ttf",18))
+		self._draw_icon(draw, "\uf118", self.oled.height*2/3)
+		self.oled.display(image)
+
+	def _prerender(self, menu):
+		"""frames for the fixed screens, and the menu's fonts and layer"""
 		font = loadfont("Raleway-Bold.ttf",18)
-		char = "\uf118"
-		with canvas(self.oled) as draw:
-			draw.text((25,5), "Welcome",fill="white",font=font)
-			w,h = draw.textsize(char,font=self.FA)
-			draw.text((self.oled.width/2-w/2,self.oled.height*2/3-h/2),char,fill="white",font=self.FA)
-			"""
-			x=self.oled.width/2
-			y=self.oled.height*2/3
-			r=12
-			draw.ellipse(circle(x,y,r), fill="white")
-			draw.ellipse(circle(x-5,y-r/2,2),fill="black")
-			draw.ellipse(circle(x+5,y-r/2,2),fill="black")
-			draw.chord((x-r+3,y-4,x+r-3,y+9), 0, 180, fill="black")
-			"""
+		image,draw = self._blank()
+		w,h = draw.textsize("Scanning...",font=font)
+		draw.text((self.oled.width/2-w/2,self.oled.height/2-h/2),"Scanning...",font=font,fill="white")
+		self.frames['scanning'] = image
+		self.frames['complete'] = self._icon_text("\uf00c", "Scan Complete", loadfont("Raleway-Bold.ttf",16))
+		self.frames['empty'] = self._icon_text("\uf05a", "no pages found")
+		self._icon("\uf071") # errors
+		menu.page.layer(self.oled)
+		for name,size in (("ProggyTiny.ttf",12), ("ProggyTiny.ttf",16), ("tiny.ttf",6)):
+			loadfont(name, size)
+
+	def _blank(self):
+		image = Image.new(self.oled.mode, self.oled.size)
+		return image, ImageDraw.Draw(image)
+
+	def _draw_icon(self, draw, icon, y):
+		w,h = draw.textsize(icon,font=self.FA)
+		draw.text((self.oled.width/2-w/2,y-h/2),icon,fill="white",font=self.FA)
+
+	def _icon(self, icon):
+		if icon not in self.icons:
+			image,draw = self._blank()
+			self._draw_icon(draw, icon, self.oled.height/3)
+			self.icons[icon] = image
+		return self.icons[icon]
+
+	def _icon_text(self, icon, txt, txtfont=None):
+		if txtfont is None:
+			txtfont = loadfont("Volter__28Goldfish_29.ttf",9)
+		image = self._icon(icon).copy()
+		draw = ImageDraw.Draw(image)
+		w,h = draw.textsize(txt,font=txtfont)
+		draw.text((self.oled.width/2-w/2,self.oled.height*2/3-h/2), txt,fill="white",font=txtfont)
+		return image
+
+	def _show(self, name):
+		self.renderer.draw(lambda: self.oled.display(self.frames[name]))
 
 	def is_asleep(self):
 		return self.state == 'OFF'
@@ -313,43 +467,62 @@ class Screen(object):
 		self.sleep_timer = Timer(t, self._sleep)
 		self.sleep_timer.start()
 	def cleanup(self):
-		self.off()
+		self.state = 'OFF'
+		with self.renderer.device_lock:
+			self.oled.hide()
 
 	def on(self):
 		self.state='ON'
-		self.oled.show()
+		self.renderer.call(self.oled.show)
 	def off(self):
 		self.state = 'OFF'
-		self.oled.hide()
+		self.renderer.call(self.oled.hide)
+
+	def _compose(self, draw, background=None, layer=None):
+		"""compose a frame holding lock, then send it without
+
+		background and layer are functions returning them, as they read
+		state too.
+		"""
+		with self.lock:
+			base = None if background is None else background()
+			if base is None:
+				image,c = self._blank()
+			else:
+				image = base.copy()
+				c = ImageDraw.Draw(image)
+			draw(c)
+			over = None if layer is None else layer()
+			if over is not None:
+				im,mask = over
+				image.paste(im, mask=mask)
+		self.oled.display(image)
 
 	def draw_menu(self, menu):
-		with screen_timeout(self), canvas(self.oled) as draw:
-			menu.draw(draw, self.oled)
+		with screen_timeout(self):
+			self.renderer.draw(lambda: self._draw_menu(menu))
+
+	def _draw_menu(self, menu):
+		self._compose(lambda c: menu.draw(c, self.oled), layer=lambda: menu.page.layer(self.oled))
+		self.ready.set()
 
 	def draw_scan(self):
-		font = loadfont("Raleway-Bold.ttf",18)
 		self.activate() # not auto-dimming here
-		with canvas(self.oled) as draw:
-			w,h = draw.textsize("Scanning...",font=font)
-			draw.text((self.oled.width/2-w/2,self.oled.height/2-h/2),"Scanning...",font=font,fill="white")
+		self._show('scanning')
 
 	def draw_icon_text(self, icon, txt, txtfont=None):
-		if txtfont is None:
-			txtfont = loadfont("Volter__28Goldfish_29.ttf",9)
-		with canvas(self.oled) as draw:
-			w,h = draw.textsize(txt,font=txtfont)
-			draw.text((self.oled.width/2-w/2,self.oled.height*2/3-h/2), txt,fill="white",font=txtfont)
-			w,h = draw.textsize(icon,font=self.FA)
-			draw.text((self.oled.width/2-w/2,self.oled.height/3-h/2),icon,fill="white",font=self.FA)
+		self.renderer.draw(lambda: self.oled.display(self._icon_text(icon, txt, txtfont)))
 
 	def draw_err(self, msg):
 		self.draw_icon_text("\uf071", msg)
 	def draw_complete(self):
-		self.draw_icon_text("\uf00c", "Scan Complete", loadfont("Raleway-Bold.ttf",16))
+		self._show('complete')
 	def draw_empty(self):
-		self.draw_icon_text("\uf05a", "no pages found")
-
-	def draw_progress(self, progress, *args):
-		with canvas(self.oled) as draw:
-			progress.draw(draw, self.oled, *args)
-
+		self._show('empty')
+
+	def draw_progress(self, progress, msg=None):
+		"""draw progress, after updating it with msg if there is one"""
+		if msg is not None:
+			with self.lock:
+				progress.update(msg)
+		self.renderer.draw(lambda: self._compose(lambda c: progress.draw(c, self.oled), background=lambda: progress.background(self.oled)))
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+import threading
+from luma.oled.device import sh1106
+
+# bytes an I2C write costs besides its payload: the address and a control byte
+I2C_OVERHEAD = 2
+# luma's i2c interface sends data at most this many bytes per write
+I2C_CHUNK = 32
+
+def i2c_cost(n, commands=False):
+	"""bytes on the bus to send n command or data bytes"""
+	if commands:
+		return I2C_OVERHEAD + n
+	return n + I2C_OVERHEAD * -(-n // I2C_CHUNK)
+
+def full_frame_cost(device):
+	"""bytes on the bus for luma's sh1106 to send a whole frame"""
+	pages = device.height // 8
+	return pages * (i2c_cost(3, True) + i2c_cost(device.width))
+
+
+class SH1106(sh1106):
+	"""sh1106 that only sends the parts of each frame that changed
+
+	The display's memory is written a page (8 pixel rows) at a time. Each
+	frame is packed into pages and compared with the last one sent; pages
+	that match are skipped and the rest are sent from their first changed
+	column to their last. numpy, which does the packing, is loaded on a
+	thread of its own so as not to hold up startup; until it is there
+	frames are sent whole by luma. bus_bytes counts what went over I2C.
+	"""
+
+	column_offset = 2 # the 128 visible columns of the 132 in memory
+
+	def __init__(self, *args, **kwargs):
+		self.bus_bytes = 0
+		self.sent = None
+		self.np = None
+		threading.Thread(target=self._load_numpy, name="numpy", daemon=True).start()
+		super(SH1106, self).__init__(*args, **kwargs)
+
+	def _load_numpy(self):
+		import numpy
+		self.np = numpy
+
+	def command(self, *cmd):
+		self.bus_bytes += i2c_cost(len(cmd), True)
+		super(SH1106, self).command(*cmd)
+
+	def data(self, data):
+		self.bus_bytes += i2c_cost(len(data))
+		super(SH1106, self).data(data)
+
+	def display(self, image):
+		assert(image.mode == self.mode)
+		assert(image.size == self.size)
+		np = self.np
+		if np is None:
+			super(SH1106, self).display(image)
+			return
+		image = self.preprocess(image)
+		pixels = np.asarray(image, dtype=np.uint8).reshape(self.height//8, 8, self.width)
+		# a byte per column of each page, its top row in the lowest bit
+		pages = (pixels << np.arange(8, dtype=np.uint8)[:,None]).sum(axis=1, dtype=np.uint8)
+		for page, row in enumerate(pages):
+			if self.sent is None:
+				changed = range(self.width)
+			else:
+				changed = np.flatnonzero(row != self.sent[page])
+				if len(changed) == 0:
+					continue
+			x0, x1 = changed[0], changed[-1]
+			column = self.column_offset + x0
+			self.command(0xB0 + page, column & 0x0F, 0x10 | column >> 4)
+			self.data(row[x0:x1+1].tolist())
+		self.sent = pages
+
+
+class SkipUnchanged(object):
+	"""mixin for a luma device that drops frames identical to the last one"""
+
+	def __init__(self, *args, **kwargs):
+		self.last = None
+		self.bus_bytes = 0
+		super(SkipUnchanged, self).__init__(*args, **kwargs)
+
+	def display(self, image):
+		data = image.tobytes()
+		if data == self.last:
+			return
+		self.last = data
+		self.bus_bytes += full_frame_cost(self)
+		super(SkipUnchanged, self).display(image)
+
+def emulator(**kwargs):
+	"""luma's pygame emulator, skipping unchanged frames, for development
+
+	bus_bytes counts what a whole-frame sh1106 would have sent.
+	"""
+	from luma.emulator.device import pygame
+	class Emulator(SkipUnchanged, pygame):
+		pass
+	return Emulator(**kwargs)
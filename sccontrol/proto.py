@@ -0,0 +1 @@
+../scingest/proto.py
\ No newline at end of file
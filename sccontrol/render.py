@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+import time
+import logging
+import threading
+from collections import deque
+import timeline
+
+
+class Renderer(object):
+	"""Draws on a display from its own thread
+
+	draw() asks for a frame. Only the latest frame asked for is drawn, and
+	no more than max_fps of them a second, so a burst of status messages
+	costs one frame rather than one each. call() runs something on the
+	render thread, in order and none dropped, for things like switching
+	the display on and off. device_lock is held while either runs, so
+	nothing else talks to the display meanwhile. lock guards the state
+	frames are drawn from: a frame holds it only while composing, not while
+	it is sent, so hold it to change that state without waiting on the
+	display. While scan is set, what is drawn goes on its timeline.
+	"""
+
+	max_fps = 15
+
+	def __init__(self):
+		super(Renderer, self).__init__()
+		self.lock = threading.RLock()
+		self.device_lock = threading.Lock()
+		self.cond = threading.Condition()
+		self.calls = deque()
+		self.frame = None
+		self.busy = False
+		self.last = 0
+		self.drawn = 0
+		self.dropped = 0
+		self.scan = None
+		self.thread = threading.Thread(target=self._run, name="render", daemon=True)
+		self.thread.start()
+
+	def draw(self, fn):
+		with self.cond:
+			if self.frame is not None:
+				self.dropped += 1
+			self.frame = fn
+			self.cond.notify_all()
+
+	def call(self, fn):
+		with self.cond:
+			self.calls.append(fn)
+			self.cond.notify_all()
+
+	def flush(self, timeout=None):
+		"""wait until everything asked for so far has been done"""
+		with self.cond:
+			return self.cond.wait_for(lambda: not (self.busy or self.calls or self.frame), timeout)
+
+	def _next(self):
+		with self.cond:
+			self.busy = False
+			self.cond.notify_all()
+			while True:
+				wait = None
+				if self.calls:
+					fn = self.calls.popleft()
+					break
+				if self.frame is not None:
+					wait = self.last + 1.0/self.max_fps - time.time()
+					if wait <= 0:
+						fn,self.frame = self.frame,None
+						self.last = time.time()
+						self.drawn += 1
+						break
+				self.cond.wait(wait)
+			self.busy = True
+			return fn
+
+	def _run(self):
+		while True:
+			fn = self._next()
+			start = time.time()
+			try:
+				with self.device_lock:
+					fn()
+			except Exception:
+				logging.exception("drawing failed")
+			timeline.record(self.scan, 'draw', start)
@@ -4,30 +4,215 @@ import atexit
 import json
 import logging
 import sys
+import time
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+import proto
+import timeline
+
+
+class ThumbnailCache(object):
+	"""Thumbnails by page, least recently used dropped past budget bytes"""
+	def __init__(self, budget):
+		super(ThumbnailCache, self).__init__()
+		self.budget = budget
+		self.pages = OrderedDict() # page -> thumbnail, oldest first
+		self.used = 0
+		self.lock = threading.Lock()
+
+	def __contains__(self, page):
+		return page in self.pages
+
+	def get(self, page):
+		with self.lock:
+			if page not in self.pages:
+				return None
+			self.pages.move_to_end(page)
+			return self.pages[page]
+
+	def put(self, page, data):
+		with self.lock:
+			if page in self.pages:
+				self.used -= len(self.pages.pop(page))
+			self.pages[page] = data
+			self.used += len(data)
+			while self.used > self.budget and len(self.pages) > 1:
+				_,old = self.pages.popitem(last=False)
+				self.used -= len(old)
+
 
 class Scanner(object):
-	"""communication with scingest"""
-	def __init__(self):
+	"""communication with scingest
+
+	The connection is kept up from a thread of its own. When it has been
+	idle for heartbeat seconds scingest is pinged, and given timeout
+	seconds to answer; a connection that fails is made again, backing off
+	to max_backoff seconds between tries. up is set while connected and
+	on_state(up) is called, from that thread, whenever that changes once
+	scingest has first been reached. No read waits on scingest for longer
+	than reply_timeout, or scan_timeout while a scan runs, so a host that
+	silently drops off loses the connection instead of hanging the caller.
+	"""
+
+	# thumbnail encodings we accept, best first (see scbench.py codecs for their cost)
+	encodings = ["jpeg:80", "zlib", "raw"]
+	thumbnail_budget = 8*2**20 # bytes of thumbnails kept
+	timeout = 3 # seconds to connect, or for a ping to be answered
+	reply_timeout = 30 # seconds for a thumbnail, tile or other reply, which may wait on a pyramid
+	scan_timeout = 600 # seconds between messages of a running scan, which may wait on the feeder
+	heartbeat = 5
+	max_backoff = 30
+
+	def __init__(self, encodings=None, on_state=None):
 		super(Scanner, self).__init__()
-		self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-		hostname = sys.argv[1] if len(sys.argv) > 1 else "closet"
-		port = int(sys.argv[2]) if len(sys.argv) > 2 else 5555
-		self.socket.connect((socket.gethostbyname(hostname),port))
+		if encodings:
+			self.encodings = encodings
+		self.on_state = on_state
+		self.hostname = sys.argv[1] if len(sys.argv) > 1 else "closet"
+		self.port = int(sys.argv[2]) if len(sys.argv) > 2 else 5555
+		self.address = None # hostname looked up, until connecting to it fails
+		self.socket = None
+		self.encoding = None
+		self.scan_id = None # of the last scan run, see timeline
+		self.up = threading.Event()
+		self.state = None # as last passed to on_state, None until first connected
+		self.last_used = 0
+		self.wake = threading.Event() # for the connection thread, when the connection drops
+		self.lock = threading.Lock() # one request and its reply at a time
+		self.thumbnails = ThumbnailCache(self.thumbnail_budget)
+		self.prefetcher = ThreadPoolExecutor(max_workers=1)
 		atexit.register(self.cleanup)
+		threading.Thread(target=self._keepalive, name="scingest", daemon=True).start()
+
+	def _connect(self):
+		if self.address is None:
+			self.address = socket.gethostbyname(self.hostname)
+		try:
+			self.socket = socket.create_connection((self.address,self.port), self.timeout)
+		except OSError:
+			self.address = None # look it up again, it may have moved
+			raise
+		self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+		self.last_used = time.time()
+		self.encoding = self._hello()
+		self.socket.settimeout(self.reply_timeout)
+
+	def _hello(self):
+		self._sendjson({"hello":{"encodings":self.encodings}})
+		reply = self._get()
+		if reply is None:
+			raise ConnectionRefusedError("scingest closed the connection")
+		_,encoding = reply.decode('utf8').split(':',1)
+		logging.debug('thumbnails will be {}'.format(encoding))
+		return encoding
+
+	def _drop(self):
+		if self.socket is not None:
+			self.socket.close()
+			self.socket = None
+		self.up.clear()
+		self.wake.set()
+
+	def _set_state(self, up):
+		if up:
+			self.up.set()
+		if not up and self.state is not True:
+			return # never connected, or already down: nothing newly lost
+		if up != self.state:
+			self.state = up
+			logging.info('scingest {}'.format("connected" if up else "unreachable"))
+			if self.on_state:
+				self.on_state(up)
+
+	def _keepalive(self):
+		backoff = 1
+		while True:
+			self.wake.clear()
+			if self.socket is None:
+				try:
+					with self.lock:
+						self._connect()
+				except OSError as e:
+					logging.debug('connecting to scingest failed: {}'.format(e))
+					self._drop()
+					self._set_state(False)
+					time.sleep(backoff)
+					backoff = min(backoff*2, self.max_backoff)
+					continue
+				backoff = 1
+				self._set_state(True)
+			idle = time.time() - self.last_used
+			if idle < self.heartbeat:
+				self.wake.wait(self.heartbeat - idle)
+			elif not self.ping():
+				self._set_state(False)
+
+	def ping(self):
+		"""check the connection, dropping it if scingest doesn't answer"""
+		with self.lock:
+			if self.socket is None:
+				return False
+			try:
+				self.socket.settimeout(self.timeout)
+				self._sendjson({"ping":True})
+				alive = self._get() == b"pong"
+			except OSError:
+				alive = False
+			if self.socket is not None:
+				self.socket.settimeout(self.reply_timeout)
+			self.last_used = time.time()
+			if not alive:
+				logging.debug('scingest did not answer a ping')
+				self._drop()
+			return alive
+
+	@contextmanager
+	def _request(self):
+		"""hold the connection for a request and its reply"""
+		with self.lock:
+			if self.socket is None:
+				raise ConnectionError("not connected to scingest")
+			try:
+				yield
+			except OSError:
+				self._drop()
+				raise
+			finally:
+				self.last_used = time.time()
 
 	def cleanup(self):
-		self.socket.close()
-	def run(self, options, process_msg):
-		self._sendjson({"scan":True,"options":options})
-
-		msg = self._get()
-		while msg is not None:
-			s = msg.decode("utf8")
-			logging.info(s)
-			exit_read_loop = process_msg(s)
-			if exit_read_loop is not None:
-				break
-			msg = self._get()
+		self.prefetcher.shutdown(wait=False, cancel_futures=True)
+		if self.socket is not None:
+			self.socket.close()
+
+	def run(self, options, process_msg, scan_id=None):
+		# prefetches queued for the last scan's pages
+		old,self.prefetcher = self.prefetcher,ThreadPoolExecutor(max_workers=1)
+		old.shutdown(wait=False, cancel_futures=True)
+		with self._request():
+			self.thumbnails = ThumbnailCache(self.thumbnail_budget) # pages of this scan from now on
+			self.scan_id = scan_id
+			cmd = {"scan":True,"options":options}
+			if scan_id is not None:
+				cmd["id"] = scan_id
+			self._sendjson(cmd)
+
+			self.socket.settimeout(self.scan_timeout)
+			try:
+				msg = self._get()
+				while msg is not None:
+					s = msg.decode("utf8")
+					logging.info(s)
+					with timeline.timed(scan_id, 'status', msg=s):
+						exit_read_loop = process_msg(s)
+					if exit_read_loop is not None:
+						break
+					msg = self._get()
+			finally:
+				if self.socket is not None:
+					self.socket.settimeout(self.reply_timeout)
 
 		# None = broken pipe
 		# True = successful scan
@@ -36,29 +221,79 @@ class Scanner(object):
 
 
 	def get_thumbnail(self, page):
-		logging.debug('requesting thumbnail for page {}'.format(page))
-		self._send(str(page))
-		return self._get()
+		data = self.thumbnails.get(page)
+		if data is not None:
+			logging.debug('thumbnail for page {} from cache'.format(page))
+			return data
+		with self._request():
+			cache = self.thumbnails # of the scan this request is answered from
+			data = cache.get(page) # fetched while we waited?
+			if data is not None:
+				return data
+			logging.debug('requesting thumbnail for page {}'.format(page))
+			with timeline.timed(self.scan_id, 'get thumbnail', page=page):
+				self._send(str(page))
+				data = self._get_image()
+		cache.put(page, data)
+		return data
+
+	def prefetch(self, pages):
+		"""fetch thumbnails for pages in the background, in order"""
+		for page in pages:
+			if page >= 0 and page not in self.thumbnails:
+				self.prefetcher.submit(self._prefetch, page)
+
+	def _prefetch(self, page):
+		try:
+			self.get_thumbnail(page)
+		except OSError as e:
+			logging.debug('prefetching page {} failed: {}'.format(page, e))
+
+	def get_levels(self, page):
+		"""(columns,rows) of tiles at each zoom level, 0 being full resolution"""
+		with self._request():
+			self._send("levels:{}".format(page))
+			return json.loads(self._reply().decode('utf8'))
+
+	def get_tile(self, page, level, x, y):
+		logging.debug('requesting tile {},{} at level {} of page {}'.format(x,y,level,page))
+		with self._request(), timeline.timed(self.scan_id, 'get tile', page=page, level=level):
+			self._send("tile:{}:{}:{}:{}".format(page,level,x,y))
+			return self._get_image()
+
+	def clock_offset(self, samples=5):
+		"""seconds scingest's clock is ahead of ours"""
+		times = []
+		with self._request():
+			for i in range(samples):
+				sent = time.time()
+				self._sendjson({"time":True})
+				_,theirs = self._reply().decode('utf8').split(':',1)
+				times.append((sent, float(theirs), time.time()))
+		return timeline.clock_offset(times)
+
+	def get_timeline(self, scan_id):
+		"""scingest's spans of a scan"""
+		with self._request():
+			self._sendjson({"timeline":scan_id})
+			return json.loads(self._reply().decode('utf8'))
+
+	def _reply(self):
+		data = self._get()
+		if data is None:
+			raise ConnectionError("scingest closed the connection")
+		return data
+
+	def _get_image(self):
+		return proto.decode_image(self._reply(), (240,320), self.encoding)
 
-	def _sendb(self, b):
-		msglen = len(b).to_bytes(4, byteorder='big')
-		self.socket.send(msglen+b)
 	def _send(self, s):
-		self._sendb(s.encode('utf8'))
+		proto.send_str(self.socket, s)
 	def _sendjson(self, thing):
-		self._send(json.dumps(thing))
+		proto.send_json(self.socket, thing)
 
 	def _get(self):
-		pkt_len = self.socket.recv(4)
-		if pkt_len == b'':
-			return None
-		pkt_len = int.from_bytes(pkt_len, byteorder='big')
-		nbytes=0
-		chunks=[]
-		while nbytes < pkt_len:
-			chunk = self.socket.recv(min(pkt_len - nbytes, 2048))
-			if chunk == b'':
-				return None
-			chunks.append(chunk)
-			nbytes += len(chunk)
-		return b''.join(chunks)
+		data = proto.recv(self.socket)
+		if data is None:
+			self._drop() # scingest closed the connection
+		return data
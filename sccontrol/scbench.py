@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+"""
+Benchmarks for sccontrol. Run on the Pi, from this directory:
+
+	./scbench.py codecs [image] [repeats]
+	./scbench.py tft [image] [repeats]
+	./scbench.py spi [frames] [call_us]
+	./scbench.py dirty [frames]
+	./scbench.py scroll [pages]
+	./scbench.py oled [pages] [gap_ms]
+"""
+
+import sys
+import time
+import numbers
+from PIL import Image, ImageDraw
+import proto
+from tft import TFT24T
+
+THUMB_SIZE = (240,320)
+
+
+def sample_thumbnail(path=None):
+	"""a scanned-looking 240x320 RGB thumbnail, or one made from an image file"""
+	if path:
+		im = Image.open(path).convert('RGB')
+		im.thumbnail(THUMB_SIZE)
+		thumb = Image.new('RGB', THUMB_SIZE, 'white')
+		thumb.paste(im, ((THUMB_SIZE[0]-im.size[0])//2, (THUMB_SIZE[1]-im.size[1])//2))
+		return thumb.tobytes()
+	thumb = Image.new('RGB', THUMB_SIZE, (250,248,240))
+	draw = ImageDraw.Draw(thumb)
+	for y in range(30, 290, 6):
+		draw.line((20, y, 220-(y*7 % 80), y), fill=(40,40,40))
+	draw.rectangle((30,40,110,100), fill=(180,60,50))
+	return thumb.tobytes()
+
+
+def bench_codecs(path=None, repeats=50):
+	data = sample_thumbnail(path)
+	repeats = int(repeats)
+	print("{:>8} {:>9} {:>10} {:>10}".format("encoding", "bytes", "encode ms", "decode ms"))
+	for spec in ("raw", "rgb565", "zlib", "jpeg:95", "jpeg:80", "jpeg:60", "jpeg:40"):
+		start = time.time()
+		for i in range(repeats):
+			payload = proto.encode_image(data, THUMB_SIZE, spec)
+		encode = (time.time()-start)*1000/repeats
+		start = time.time()
+		for i in range(repeats):
+			proto.decode_image(payload, THUMB_SIZE, spec)
+		decode = (time.time()-start)*1000/repeats
+		print("{:>8} {:9d} {:10.2f} {:10.2f}".format(spec, len(payload), encode, decode))
+
+
+def legacy_image_to_data(image):
+	"""TFT24T.image_to_data as it was, a pixel at a time"""
+	pixels = image.convert('RGB').load()
+	width, height = image.size
+	for y in range(height):
+		for x in range(width):
+			r,g,b = pixels[(x,y)]
+			color = ((r & 0xF8) << 8) | ((g & 0xFC) << 3) | (b >> 3)
+			yield (color >> 8) & 0xFF
+			yield color & 0xFF
+
+def bench_tft(path=None, repeats=5):
+	"""full-frame RGB to RGB565 conversion, as done for every LCD frame"""
+	image = Image.frombytes('RGB', THUMB_SIZE, sample_thumbnail(path))
+	repeats = int(repeats)
+	tft = TFT24T(None, None)
+	start = time.time()
+	for i in range(repeats):
+		legacy = list(legacy_image_to_data(image))
+	before = (time.time()-start)*1000/repeats
+	start = time.time()
+	for i in range(repeats):
+		data = tft.image_to_data(image)
+	after = (time.time()-start)*1000/repeats
+	assert bytes(legacy) == data
+	print("per frame: {:.1f} ms before, {:.2f} ms now ({:.0f}x)".format(before, after, before/after))
+
+
+class FakeSpiDev(object):
+	"""spidev stand-in that costs call_us per system call plus the time on the wire"""
+	def __init__(self, call_us=20):
+		super(FakeSpiDev, self).__init__()
+		self.call = call_us/1e6
+		self.max_speed_hz = 500000
+		self.opens = 0
+		self.calls = 0
+		self.sent = 0
+	def _cost(self, n=0):
+		self.calls += 1
+		self.sent += n
+		time.sleep(self.call + n*8.0/self.max_speed_hz)
+	def open(self, bus, ce):
+		self.opens += 1
+		self._cost()
+	def close(self):
+		self._cost()
+	def writebytes(self, data):
+		if len(data) > 4096:
+			raise OverflowError("writebytes takes at most 4096 bytes")
+		self._cost(len(data))
+	def writebytes2(self, data):
+		self._cost(len(data))
+	def xfer(self, data):
+		self._cost(len(data))
+		return [0]*len(data)
+
+class FakeGPIO(object):
+	IN, OUT, HIGH, LOW = 1, 0, 1, 0
+	def setup(self, pin, direction):
+		pass
+	def output(self, pin, value):
+		pass
+	def input(self, pin):
+		return 1
+
+class LegacyTFT(TFT24T):
+	"""TFT24T sending as it did: the bus opened and closed around every write"""
+	def send2lcd(self, data, is_data=True, chunk_size=4096):
+		self._gpio.output(self._dc, is_data)
+		self._spi.open(0, self._ce_lcd)
+		self._spi.max_speed_hz=self._spi_speed_lcd
+		if isinstance(data, numbers.Number):
+			data = [data & 0xFF]
+		for start in range(0, len(data), chunk_size):
+			end = min(start+chunk_size, len(data))
+			self._spi.writebytes(list(data[start:end]))
+		self._spi.close()
+
+def bench_spi(frames=20, call_us=20):
+	"""LCD frame rate over a fake SPI bus, bus setup and per-call overhead included"""
+	frames = int(frames)
+	image = Image.frombytes('RGB', THUMB_SIZE, sample_thumbnail())
+	for cls in (LegacyTFT, TFT24T):
+		spi = FakeSpiDev(int(call_us))
+		tft = cls(spi, FakeGPIO())
+		tft.initLCD(18, 22, 12)
+		spi.opens = spi.calls = spi.sent = 0
+		start = time.time()
+		for i in range(frames):
+			tft._shown = None # a whole frame each time, not nothing for an unchanged screen
+			tft.display(image)
+		elapsed = time.time()-start
+		print("{:>9}: {:5.1f} frames/s, {} opens and {} calls per frame".format(
+			cls.__name__, frames/elapsed, spi.opens//frames, spi.calls//frames))
+
+
+def bench_dirty(frames=20):
+	"""LCD bytes and time per frame, flipping between similar thumbnails
+	and moving a small overlay, with and without partial updates"""
+	frames = int(frames)
+	base = Image.frombytes('RGB', THUMB_SIZE, sample_thumbnail())
+	screens = []
+	for i in range(frames):
+		im = base.copy()
+		draw = ImageDraw.Draw(im)
+		draw.text((100,300), "page {}".format(i//2+1), fill=(0,0,0))
+		if i % 2:
+			draw.rectangle((60,140,180,180), outline=(0,0,255), width=3) # crop box overlay
+		screens.append(im)
+	for name,full_push in (("full", 0), ("dirty", TFT24T.full_push)):
+		spi = FakeSpiDev()
+		tft = TFT24T(spi, FakeGPIO())
+		tft.full_push = full_push
+		tft.initLCD(18, 22, 12)
+		tft.display(base)
+		spi.sent = 0
+		start = time.time()
+		for im in screens:
+			tft.display(im)
+		elapsed = time.time()-start
+		print("{:>6}: {:7d} bytes, {:6.1f} ms per frame".format(name, spi.sent//frames, elapsed*1000/frames))
+
+
+def bench_scroll(pages=50):
+	"""paging through a scan on the LCD: whole frames against hardware scrolling"""
+	pages = int(pages)
+	base = Image.frombytes('RGB', THUMB_SIZE, sample_thumbnail())
+	thumbs = []
+	for i in range(pages):
+		# pages differ all over, as different scanned pages do
+		im = base.rotate(180) if i % 2 else base.copy()
+		ImageDraw.Draw(im).text((100,300), "page {}".format(i+1), fill=(0,0,0))
+		thumbs.append(proto.encode_image(im.tobytes(), THUMB_SIZE, "rgb565"))
+	for name in ("display", "scroll"):
+		tft = TFT24T(FakeSpiDev(), FakeGPIO())
+		tft.initLCD(18, 22, 12)
+		tft.display_rgb565(thumbs[0])
+		first = [] # time until the screen first changes, when scrolling
+		def moved(line, set_vsp=tft.vertical_scroll):
+			if len(first) < len(times)+1:
+				first.append(time.time()-started)
+			set_vsp(line)
+		tft.vertical_scroll = moved
+		times = []
+		for data in thumbs[1:]:
+			started = time.time()
+			if name == "display":
+				tft.display_rgb565(data)
+			else:
+				tft.scroll_rgb565(data, from_top=True)
+			times.append(time.time()-started)
+		react = first if first else times
+		print("{:>8}: {:5.1f} ms per page, screen changes after {:4.1f} ms".format(
+			name, sum(times)*1000/len(times), sum(react)*1000/len(react)))
+
+class FakeI2C(object):
+	"""luma serial interface that goes nowhere"""
+	def command(self, *cmd):
+		pass
+	def data(self, data):
+		pass
+	def cleanup(self):
+		pass
+
+def bench_oled(pages=10, gap_ms=20):
+	"""I2C bytes to the OLED over a scan, replaying what scserver sends
+	gap_ms apart, quicker than frames are drawn, so they get coalesced"""
+	from sccontrol import Menu, IO_Mgr
+	from display import Screen, ProgressPage
+	from oled import SH1106, full_frame_cost
+	pages = int(pages)
+	gap = int(gap_ms)/1000.0
+	device = SH1106(FakeI2C())
+	frames = []
+	def display(image, display=device.display):
+		frames.append(image)
+		display(image)
+	device.display = display
+	menu = Menu()
+	screen = Screen(menu, device)
+	io = IO_Mgr(None, screen, menu, None)
+	screen.renderer.flush()
+	start = device.bus_bytes
+	asked = screen.renderer.drawn + screen.renderer.dropped
+	del frames[:]
+	for i in range(4):
+		menu.down()
+		screen.draw_menu(menu)
+	screen.draw_scan()
+	progress = ProgressPage()
+	status = io.handle_status(progress)
+	for i in range(pages):
+		for msg in ("feed start", "page fed", "PAGE {}".format(i+1)):
+			status(msg)
+			time.sleep(gap)
+	for msg in ("feed start", "pages end", "complete"):
+		status(msg)
+		time.sleep(gap)
+	screen.draw_progress(progress, "")
+	for i in range(pages+1): # the last press is on the last page already
+		with screen.lock:
+			progress.down()
+		screen.draw_progress(progress, "")
+		time.sleep(gap)
+	screen.draw_complete()
+	screen.renderer.flush()
+	if screen.sleep_timer:
+		screen.sleep_timer.cancel()
+	asked = screen.renderer.drawn + screen.renderer.dropped - asked
+	print("{} frames asked for, {} drawn: {} bytes as whole frames, {} sent".format(
+		asked, len(frames), asked*full_frame_cost(device), device.bus_bytes-start))
+
+
+if __name__ == "__main__":
+	benches = {
+		'codecs': bench_codecs,
+		'tft': bench_tft,
+		'spi': bench_spi,
+		'dirty': bench_dirty,
+		'scroll': bench_scroll,
+		'oled': bench_oled,
+	}
+	if len(sys.argv) < 2 or sys.argv[1] not in benches:
+		print("usage: {} [{}] [args...]".format(sys.argv[0], "|".join(benches)))
+		sys.exit(1)
+	benches[sys.argv[1]](*sys.argv[2:])
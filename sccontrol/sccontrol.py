@@ -1,11 +1,14 @@
 #!/usr/bin/env python3
+import time
+started = time.time()
+import os
 import sys
+import tempfile
+import threading
 from signal import signal, SIGTERM, SIGINT
-import time
-from socket import gaierror as sock_err
 import logging
-from util import is_pi
-from scan import Scanner
+import timeline
+from util import is_pi, phases, screen_timeout
 from ui import Button_Interface, Keys_Interface
 from display import MenuPage, SettingPage, ProgressPage, Screen, LCD, Mock_LCD
 
@@ -40,6 +43,7 @@ class Menu(object):
 		self.settings.append(Setting({"DPI":"resolution"},list(range(50,601,50)),500))
 		self.settings.append(Setting({"Sides":"source"},({1:"ADF Front"},{2:"ADF Duplex"}),2))
 		self.settings.append(Setting({"Rotate":"swdeskew"},({"on":1},{"off":0}),"on"))
+		self.settings.append(Setting({"Save as":"format"},({"TIFF":"tiff"},{"PDF":"pdf"},{"PNG":"png"},{"JPEG":"jpeg"}),"TIFF"))
 		self.main = MenuPage("Main Menu", self.settings)
 		self.page = self.main
 
@@ -60,6 +64,10 @@ class Menu(object):
 
 class IO_Mgr(object):
 	"""Manager for a collection of buttons"""
+
+	# each scan's timeline, ours and scingest's, is written here once its pages are put away
+	trace_path = os.path.join(tempfile.gettempdir(), "sccontrol-scan.trace.json")
+
 	def __init__(self, interface, screen, menu, lcd):
 		super(IO_Mgr, self).__init__()
 		self.buttons=[]
@@ -67,9 +75,26 @@ class IO_Mgr(object):
 		self.screen=screen
 		self.menu = menu
 		self.lcd = lcd
+		self.scanner = None
+		self.scanning = False
+
+	def connect(self):
+		from scan import Scanner # not needed until the menu is up
+		self.scanner = Scanner(self.lcd.encodings, self.server_state)
+
+	# called from the scanner's thread as the connection to scingest comes and goes
+	def server_state(self, up):
+		if self.scanning:
+			return # the scan shows its own errors
+		if up:
+			self.screen.draw_menu(self.menu)
+		else:
+			with screen_timeout(self.screen):
+				self.screen.draw_err("lost the server")
 
 	# called as callback from server scanner.run, server comms
 	# return true to exit scanner running
+	# drawing happens on the screen's render thread, so this never waits on the OLED
 	def handle_status(self, progress):
 		def response(msg):
 			msg,*args = msg.split(":",maxsplit=1)
@@ -78,11 +103,18 @@ class IO_Mgr(object):
 				self.screen.draw_err(*args)
 				return False # @todo: what if there are further status messages?
 			elif msg == "complete":
-				progress.complete = True
+				with self.screen.lock:
+					progress.finish()
 				return True # break read-cycle to handle scan completion
 			elif msg == "empty scan":
 				self.screen.draw_empty()
 				return False
+			elif msg == "blank":
+				with self.screen.lock:
+					progress.drop(int(*args))
+				self.screen.draw_progress(progress, "skipped blank page")
+			elif msg == "queued":
+				self.screen.draw_progress(progress, "waiting on {} scan(s)".format(*args))
 			else:
 				self.screen.draw_progress(progress, msg)
 		return response
@@ -98,50 +130,119 @@ class IO_Mgr(object):
 				break
 
 	def scan(self):
-		try:
-			scanner = Scanner()
-		except ConnectionRefusedError:
-			logging.debug("could not connect to scingest")
+		# connected already, unless scingest went away: then give it a moment
+		scanner = self.scanner
+		if scanner is None or not scanner.up.wait(scanner.timeout):
+			logging.debug("not connected to scingest")
 			self.screen.draw_err("couldn't find server")
 			time.sleep(2)
 			self.screen.draw_menu(self.menu)
 			return
-		except sock_err:
-			logging.debug("got socket error")
-			self.screen.draw_err("server conn problem")
-			time.sleep(2)
-			self.screen.draw_menu(self.menu)
-			return
+		scan_id = os.urandom(6).hex()
+		self.scanning = True
+		self.screen.renderer.scan = scan_id
+		try:
+			self._scan(scanner, scan_id)
+		finally:
+			self.scanning = False
+			self.screen.renderer.scan = None
+		threading.Thread(target=self.save_trace, args=(scanner, scan_id), daemon=True).start()
+		self.screen.draw_menu(self.menu)
 
+	def save_trace(self, scanner, scan_id):
+		try:
+			offset = scanner.clock_offset()
+			theirs = scanner.get_timeline(scan_id)
+		except OSError as e:
+			logging.debug("no timeline from scingest: {}".format(e))
+			offset,theirs = 0,[]
+		processes = [("sccontrol", timeline.take(scan_id), 0), ("scingest", theirs, offset)]
+		timeline.write(self.trace_path, processes)
+		logging.debug("scan {} timeline written to {}, scingest's clock {:+.1f} ms off".format(
+			scan_id, self.trace_path, offset*1000))
+
+	def _scan(self, scanner, scan_id):
+		pressed = time.time()
 		settings = {}
 		for s in self.menu.settings:
 			logging.debug("setting {} = {}".format(s.setting_name,s.setting_values[s.index()]))
 			settings[s.setting_name] = s.setting_values[s.index()]
 
+		bus_bytes = self.screen.oled.bus_bytes
+		renderer = self.screen.renderer
+		drawn,dropped = renderer.drawn,renderer.dropped
 		progress = ProgressPage()
-		success = scanner.run(settings,self.handle_status(progress))
-
-		if success:
+		try:
+			success = scanner.run(settings,self.handle_status(progress),scan_id)
+		except OSError:
+			success = None
+		timeline.record(scan_id, 'scan', pressed, success=success)
+		if success is None:
+			logging.debug("lost scingest during the scan")
+			self.screen.draw_err("server conn problem")
+		elif success:
 			self.screen.draw_progress(progress,"")
+			self.prefetch(scanner,progress)
 			self.listen(self.progress_button_handler(scanner,progress))
 		
 		self.listen(self.acknowledge_button_handler)
+		logging.debug("OLED: {} frames drawn, {} skipped as superseded, {} bytes over I2C this scan".format(
+			renderer.drawn-drawn, renderer.dropped-dropped, self.screen.oled.bus_bytes-bus_bytes))
 
 		self.lcd.cleanup()
-		scanner.cleanup()
-		self.screen.draw_menu(self.menu)
+
+	def prefetch(self,scanner,progress):
+		# the selected page first, then where up or down would go
+		page = progress.page_index()
+		pages = len(progress.kept())
+		scanner.prefetch([p for p in (page, page+1, page-1) if 0 <= p < pages])
 
 	def progress_button_handler(self,scanner,progress):
+		# repeated enter zooms into the centre of the page a level at a time
+		zoom = {'page':None,'level':None}
+		def browse(later):
+			# with a page up on the LCD, scroll the newly selected one in
+			page = progress.page_index()
+			if not self.lcd.state or page == zoom['page']:
+				return
+			zoom.update(page=page, level=None)
+			data = scanner.get_thumbnail(page)
+			with timeline.timed(scanner.scan_id, 'LCD scroll', page=page):
+				self.lcd.scroll(data, scanner.encoding, later)
 		def fn(action):
+			try:
+				press(action)
+			except OSError:
+				logging.debug("lost scingest while browsing")
+				self.screen.draw_err("lost the server")
+		def press(action):
 			if action == 'up':
-				progress.up()
+				with self.screen.lock:
+					progress.up()
 				self.screen.draw_progress(progress,"")
+				browse(later=False)
+				self.prefetch(scanner,progress)
 			elif action == 'down':
-				progress.down()
+				with self.screen.lock:
+					progress.down()
 				self.screen.draw_progress(progress,"")
+				browse(later=True)
+				self.prefetch(scanner,progress)
 			elif action == 'enter':
-				data = scanner.get_thumbnail(progress.selected)
-				self.lcd.show(data)
+				page = progress.page_index()
+				level = None
+				if zoom['page'] == page:
+					levels = scanner.get_levels(page)
+					level = len(levels)-2 if zoom['level'] is None else zoom['level']-1
+				if level is None or level < 0:
+					data = scanner.get_thumbnail(page)
+					level = None
+				else:
+					cols,rows = levels[level]
+					data = scanner.get_tile(page, level, cols//2, rows//2)
+				zoom.update(page=page, level=level)
+				with timeline.timed(scanner.scan_id, 'LCD show', page=page, level=level):
+					self.lcd.show(data, scanner.encoding)
 			elif action == 'scan':
 				self.screen.draw_complete()
 				raise StopIteration
@@ -152,13 +253,16 @@ class IO_Mgr(object):
 			self.screen.on()
 			return
 		if action == 'up':
-			self.menu.up()
+			with self.screen.lock:
+				self.menu.up()
 			self.screen.draw_menu(self.menu)
 		elif action == 'down':
-			self.menu.down()
+			with self.screen.lock:
+				self.menu.down()
 			self.screen.draw_menu(self.menu)
 		elif action == 'enter':
-			self.menu.enter()
+			with self.screen.lock:
+				self.menu.enter()
 			self.screen.draw_menu(self.menu)
 		elif action == 'scan':
 			self.screen.draw_scan()
@@ -173,13 +277,26 @@ def cleanup_at_exit():
 	signal(SIGINT, lambda signum, stack_frame: sys.exit(1))
 
 def main():
+	startup = phases(started)
+	startup.mark("imports")
 	cleanup_at_exit()
 	pins=(11,13,15,16)
 	menu = Menu()
-	screen = Screen(menu)
+	screen = Screen(menu, startup=startup)
+	startup.mark("OLED")
 	interface = Button_Interface(pins) if is_pi() else Keys_Interface()
 	lcd = LCD() if is_pi() else Mock_LCD()
 	io = IO_Mgr(interface, screen, menu, lcd)
+	startup.mark("buttons and LCD")
+	def report():
+		screen.ready.wait()
+		startup.mark("until the menu was up")
+		logging.info("startup: {}".format(startup.report()))
+	threading.Thread(target=report, daemon=True).start()
+	def connect():
+		screen.ready.wait()
+		io.connect()
+	threading.Thread(target=connect, daemon=True).start()
 	io.listen()
 
 if __name__ == "__main__":
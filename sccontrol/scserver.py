@@ -8,41 +8,41 @@ from PIL import Image, ImageDraw, ImageFont
 logging.basicConfig(level=logging.DEBUG,format="%(asctime)s %(levelname)7s : %(message)s")
 
 
-def sendjson(sock, obj):
-	return send(sock,json.dumps(obj))
-def sendb(sock, b):
-	msglen = len(b).to_bytes(4, byteorder='big')
-	sock.send(msglen+b)	
-def send(sock, s):
-	sendb(sock, s.encode('utf8'))
-
-
-def recv(sock):
-	pkt_len = sock.recv(4)
-	if pkt_len == b'':
-		return None
-	pkt_len = int.from_bytes(pkt_len, byteorder='big')
-	nbytes=0
-	chunks=[]
-	while nbytes < pkt_len:
-		chunk = sock.recv(min(pkt_len - nbytes, 2048))
-		if chunk == b'':
-			return None
-		chunks.append(chunk)
-		nbytes += len(chunk)
-	return b''.join(chunks)
+from proto import recv, send as sendb, send_str as send, choose_encoding, encode_image
 
 
 def handle_conn(sock, addr):
+	# sccontrol keeps its connection, so take commands until it goes away
 	logging.debug("got connection from {}".format(addr))
-	init = json.loads(recv(sock).decode('utf8'))
-	cmd = init['scan']
-	opts = init['options']
-	logging.debug('got SCAN command: {}, options: {}'.format(cmd,opts))
+	encoding = "raw"
+	req = recv(sock)
+	while req != None:
+		req = req.decode('utf8')
+		if not req.startswith('{'):
+			page_request(sock, req, encoding)
+		else:
+			cmd = json.loads(req)
+			if 'hello' in cmd:
+				encoding = choose_encoding(cmd['hello'].get('encodings', []))
+				send(sock, "encoding:{}".format(encoding))
+			elif cmd.get('ping'):
+				send(sock, "pong")
+			elif cmd.get('time'):
+				send(sock, "time:{!r}".format(time.time()))
+			elif 'timeline' in cmd:
+				send(sock, "[]") # no spans recorded here
+			elif 'scan' in cmd:
+				scan(sock, cmd['options'], encoding)
+		req = recv(sock)
 
+	logging.debug('connection finished')
+	sock.close()
+
+def scan(sock, opts, encoding):
+	logging.debug('got SCAN command, options: {}'.format(opts))
 	if opts['mode'] == 'Color':
 		logging.debug('simulating a normal scan')
-		normal_scan(sock)
+		normal_scan(sock, encoding)
 	elif opts['mode'] == 'Gray':
 		logging.debug('simulating empty paper tray')
 		empty_scan(sock)
@@ -50,19 +50,19 @@ def handle_conn(sock, addr):
 		logging.debug('simulating an error')
 		error_scan(sock)
 
-	logging.debug('connection finished')
-	sock.close()
-
 
 
-def normal_scan(sock):
+def normal_scan(sock, encoding):
 	side="f"
 	for i in range(random.randint(2,10)):
 		send(sock, "feed start")
 		time.sleep(1 if side == "f" else 0.5)
 		send(sock, "page fed" if side == "f" else "backside")
 		time.sleep(0.5)
-		send(sock, "PAGE {}".format(i+1))
+		if random.random() < 0.2:
+			send(sock, "blank:{}".format(i+1))
+		else:
+			send(sock, "PAGE {}".format(i+1))
 		if side == "b":
 			side = "f"
 		else:
@@ -71,18 +71,25 @@ def normal_scan(sock):
 	send(sock, "pages end")
 	send(sock, "complete")
 
-	req = recv(sock)
-	while req != None:
-		page = int(req.decode('utf8'))
+def page_request(sock, req, encoding):
+	cmd,*args = req.split(':')
+	if cmd == 'levels':
+		logging.info("got zoom levels request for [{}]".format(args[0]))
+		send(sock, json.dumps([[4,4],[2,2],[1,1]]))
+	elif cmd == 'tile':
+		logging.info("got tile request for {}".format(args))
+		sendb(sock, encode_image(fake_page("{}:{}\n{},{}".format(*args), 30), (240,320), encoding))
+	else:
+		page = int(cmd)
 		logging.info("got page request for [{}]".format(page))
-		im = Image.new('RGB', (240,320), (182,239,196))
-		draw = ImageDraw.Draw(im)
-		font = ImageFont.truetype('fonts/Raleway-Bold.ttf',80)
-		draw.text((90,100),str(page+1),font=font,fill=(0,0,0))
-		del font
-		del draw
-		sendb(sock, im.tobytes())
-		req = recv(sock)
+		sendb(sock, encode_image(fake_page(str(page+1), 80), (240,320), encoding))
+
+def fake_page(txt, size):
+	im = Image.new('RGB', (240,320), (182,239,196))
+	draw = ImageDraw.Draw(im)
+	font = ImageFont.truetype('fonts/Raleway-Bold.ttf',size)
+	draw.multiline_text((90,100),txt,font=font,fill=(0,0,0))
+	return im.tobytes()
 
 
 
@@ -23,6 +23,8 @@ margin = 13
 import numbers
 import time
 
+import numpy as np
+
 from PIL import Image
 from PIL import ImageDraw
 import textwrap
@@ -43,7 +45,9 @@ ILI9341_CASET       = 0x2A
 ILI9341_PASET       = 0x2B
 ILI9341_RAMWR       = 0x2C
 ILI9341_RAMRD       = 0x2E
+ILI9341_VSCRDEF     = 0x33
 ILI9341_MADCTL      = 0x36
+ILI9341_VSCRSADD    = 0x37
 ILI9341_PIXFMT      = 0x3A
 ILI9341_FRMCTR1     = 0xB1
 ILI9341_DFUNCTR     = 0xB6
@@ -69,6 +73,8 @@ class TFT24T():
         self.is_landscape = landscape
         self._spi = spi
         self._gpio = gpio
+        self._ce_open = None
+        self._shown = None   # the last frame pushed, as 565 pixels
 
 # TOUCHSCREEN HARDWARE PART
 
@@ -89,11 +95,8 @@ class TFT24T():
         return not self._gpio.input(self._pen)
 
     def readValue(self, channel):
-        self._spi.open(0, self._ce_tch)
-        self._spi.max_speed_hz=self._spi_speed_tch
-
+        self._select(self._ce_tch, self._spi_speed_tch)
         responseData = self._spi.xfer([channel , 0, 0])
-        self._spi.close()
         return (responseData[1] << 5) | (responseData[2] >> 3)
         # Pick off the 12-bit reply
 
@@ -134,21 +137,40 @@ class TFT24T():
 
 #    TFT/LCD part
 
+    def _select(self, ce, speed):
+        # The bus is opened once and left open. Only switching between the
+        # LCD and the touch controller (the other chip enable) reopens it.
+        if self._ce_open == ce:
+            return
+        if self._ce_open is not None:
+            self._spi.close()
+        self._spi.open(0, ce)
+        self._spi.max_speed_hz = speed
+        self._ce_open = ce
+
+    def close(self):
+        """Release the SPI bus. The next transfer opens it again."""
+        if self._ce_open is not None:
+            self._spi.close()
+            self._ce_open = None
+
     def send2lcd(self, data, is_data=True, chunk_size=4096):
 
+        self._select(self._ce_lcd, self._spi_speed_lcd)
         # Set DC low for command, high for data.
         self._gpio.output(self._dc, is_data)
-        self._spi.open(0, self._ce_lcd)
-        self._spi.max_speed_hz=self._spi_speed_lcd
 
         # Convert scalar argument to list so either can be passed as parameter.
         if isinstance(data, numbers.Number):
             data = [data & 0xFF]
+        if hasattr(self._spi, 'writebytes2'):
+            # spidev >= 3.3 takes any buffer, of any length, in one call
+            self._spi.writebytes2(data)
+            return
         # Write data a chunk at a time.
         for start in range(0, len(data), chunk_size):
             end = min(start+chunk_size, len(data))
-            self._spi.writebytes(data[start:end])
-        self._spi.close()
+            self._spi.writebytes(list(data[start:end]))
 
     def command(self, data):
         """Write a byte or array of bytes to the display as command data."""
@@ -158,6 +180,15 @@ class TFT24T():
         """Write a byte or array of bytes to the display as display data."""
         self.send2lcd(data, True)
 
+    def commands(self, sequence):
+        """Write a sequence of (command, data) pairs back to back on the
+        open bus, data being None for a bare command.
+        """
+        for cmd, data in sequence:
+            self.send2lcd(cmd, False)
+            if data is not None:
+                self.send2lcd(data, True)
+
     def resetlcd(self):
         if self._rst is not None:
             self._gpio.output(self._rst, self._gpio.HIGH)
@@ -168,34 +199,29 @@ class TFT24T():
             time.sleep(0.150)
         else:
             self.command(ILI9341_SWRESET)
-            sleep(1)
+            time.sleep(1)
+
+    INIT9341 = (
+        (ILI9341_PWCTR1, [0x23]),
+        (ILI9341_PWCTR2, [0x10]),
+        (ILI9341_VMCTR1, [0x3e, 0x28]),
+        (ILI9341_VMCTR2, [0x86]),
+        (ILI9341_MADCTL, [0x48]),
+        (ILI9341_PIXFMT, [0x55]),
+        (ILI9341_FRMCTR1, [0x00, 0x18]),
+        (ILI9341_DFUNCTR, [0x08, 0x82, 0x27]),
+        (0xF2, [0x00]),
+        (ILI9341_GAMMASET, [0x01]),
+        (ILI9341_GMCTRP1, [0x0F, 0x31, 0x2b, 0x0c, 0x0e, 0x08, 0x4e, 0xf1, 0x37, 0x07, 0x10, 0x03, 0x0e, 0x09, 0x00]),
+        (ILI9341_GMCTRN1, [0x00, 0x0e, 0x14, 0x03, 0x11, 0x07, 0x31, 0xc1, 0x48, 0x08, 0x0f, 0x0c, 0x31, 0x36, 0x0f]),
+        # the whole screen scrolls: no fixed area above or below it
+        (ILI9341_VSCRDEF, [0, 0, ILI9341_TFTHEIGHT >> 8, ILI9341_TFTHEIGHT & 0xFF, 0, 0]),
+        (ILI9341_VSCRSADD, [0, 0]),
+        (ILI9341_SLPOUT, None),
+    )
 
     def _init9341(self):
-        self.command(ILI9341_PWCTR1)
-        self.data(0x23)
-        self.command(ILI9341_PWCTR2)
-        self.data(0x10)
-        self.command(ILI9341_VMCTR1)
-        self.data([0x3e, 0x28])
-        self.command(ILI9341_VMCTR2)
-        self.data(0x86)
-        self.command(ILI9341_MADCTL)
-        self.data(0x48)
-        self.command(ILI9341_PIXFMT)
-        self.data(0x55)
-        self.command(ILI9341_FRMCTR1)
-        self.data([0x00, 0x18])
-        self.command(ILI9341_DFUNCTR)
-        self.data([0x08, 0x82, 0x27])
-        self.command(0xF2)
-        self.data(0x00)
-        self.command(ILI9341_GAMMASET)
-        self.data(0x01)
-        self.command(ILI9341_GMCTRP1)
-        self.data([0x0F, 0x31, 0x2b, 0x0c, 0x0e, 0x08, 0x4e, 0xf1, 0x37, 0x07, 0x10, 0x03, 0x0e, 0x09, 0x00])
-        self.command(ILI9341_GMCTRN1)
-        self.data([0x00, 0x0e, 0x14, 0x03, 0x11, 0x07, 0x31, 0xc1, 0x48, 0x08, 0x0f, 0x0c, 0x31, 0x36, 0x0f])
-        self.command(ILI9341_SLPOUT)
+        self.commands(self.INIT9341)
         time.sleep(0.120)
         self.command(ILI9341_DISPON)
 
@@ -222,6 +248,7 @@ class TFT24T():
             Buffer = Image.new('RGB', (ILI9341_TFTWIDTH, ILI9341_TFTHEIGHT))
         # and a backup buffer for backup/restore
         self.buffer2 = Buffer.copy()
+        self._shown = None
         self.resetlcd()
         self._init9341()
 
@@ -231,11 +258,11 @@ class TFT24T():
             x1 = ILI9341_TFTWIDTH-1
         if y1 is None:
             y1 = ILI9341_TFTHEIGHT-1
-        self.command(ILI9341_CASET)        # Column addr
-        self.data([x0 >> 8, x0, x1 >> 8, x1])
-        self.command(ILI9341_PASET)        # Row addr
-        self.data([y0 >> 8, y0, y1 >> 8, y1])
-        self.command(ILI9341_RAMWR)
+        self.commands((
+            (ILI9341_CASET, [x0 >> 8, x0 & 0xFF, x1 >> 8, x1 & 0xFF]),  # Column addr
+            (ILI9341_PASET, [y0 >> 8, y0 & 0xFF, y1 >> 8, y1 & 0xFF]),  # Row addr
+            (ILI9341_RAMWR, None),
+        ))
 
     def display(self, image=None):
         """Write the display buffer or provided image to the hardware.  If no
@@ -249,12 +276,100 @@ class TFT24T():
         if image.size[0] == 320:
             image = image.rotate(90)
 
-        # Set address bounds to entire display.
-        self.set_frame()
-        # Convert image to array of 16bit 565 RGB data bytes.
-        pixelbytes = list(self.image_to_data(image))
-        # Write data to hardware.
-        self.data(pixelbytes)
+        # Convert image to 16bit 565 RGB pixels and write what changed to hardware.
+        self._push(self.image_to_pixels(image))
+
+    def display_rgb565(self, data):
+        """Write a whole screen of already packed 16-bit 565 RGB bytes, in
+        the order the hardware scans them, to the display.
+        """
+        self._push(np.frombuffer(data, dtype='>u2').reshape(ILI9341_TFTHEIGHT, ILI9341_TFTWIDTH))
+
+    # Frames are compared with the last one pushed, and only the rectangles
+    # around changed rows are sent. Changed rows less than band_gap apart
+    # share a rectangle, since each costs a set_frame. Above full_push of
+    # the screen, sending it all is cheaper.
+    band_gap = 8
+    full_push = 0.6
+
+    def dirty_rects(self, frame):
+        """(x0, y0, x1, y1) rectangles, inclusive, covering every pixel of
+        frame that differs from the last frame pushed.
+        """
+        if self._shown is None or self._shown.shape != frame.shape:
+            return [(0, 0, frame.shape[1]-1, frame.shape[0]-1)]
+        changed = frame != self._shown
+        rows = np.flatnonzero(changed.any(axis=1))
+        if len(rows) == 0:
+            return []
+        breaks = np.flatnonzero(np.diff(rows) > self.band_gap)
+        rects = []
+        for y0, y1 in zip(rows[np.r_[0, breaks+1]], rows[np.r_[breaks, len(rows)-1]]):
+            cols = np.flatnonzero(changed[y0:y1+1].any(axis=0))
+            rects.append((cols[0], y0, cols[-1], y1))
+        return rects
+
+    def _push_rects(self, frame):
+        """the rectangles _push sends: the dirty ones, or the whole frame"""
+        height, width = frame.shape
+        rects = self.dirty_rects(frame)
+        area = sum((x1-x0+1)*(y1-y0+1) for x0, y0, x1, y1 in rects)
+        if area > self.full_push*width*height:
+            rects = [(0, 0, width-1, height-1)]
+        return rects
+
+    def _push(self, frame, rects=None):
+        if rects is None:
+            rects = self._push_rects(frame)
+        for x0, y0, x1, y1 in rects:
+            self.set_frame(int(x0), int(y0), int(x1), int(y1))
+            self.data(frame[y0:y1+1, x0:x1+1].astype('>u2').tobytes())
+        self._shown = frame
+
+    # lines brought in per scroll step
+    scroll_step = 16
+
+    def scroll(self, image, from_top=False):
+        """Bring image onto the display by scrolling the current one out,
+        the new image coming in from the top of the hardware's frame or
+        from the bottom. Each step fills only the lines scrolling into view
+        and then moves the scroll start address. A frame that differs from
+        the current one in less than full_push of the screen is pushed as
+        its dirty rectangles instead, which is quicker.
+        """
+        if image.size[0] == 320:
+            image = image.rotate(90)
+        self._scroll(self.image_to_pixels(image), from_top)
+
+    def scroll_rgb565(self, data, from_top=False):
+        """scroll() for already packed 16-bit 565 RGB bytes"""
+        self._scroll(np.frombuffer(data, dtype='>u2').reshape(ILI9341_TFTHEIGHT, ILI9341_TFTWIDTH), from_top)
+
+    def _scroll(self, frame, from_top):
+        height, width = frame.shape
+        if self._shown is None or self._shown.shape != frame.shape:
+            # nothing known on screen to scroll away
+            self._push(frame)
+            return
+        rects = self._push_rects(frame)
+        if rects != [(0, 0, width-1, height-1)]:
+            # little of it changes
+            self._push(frame, rects)
+            return
+        # Line n of the new frame goes to memory line n, so once a full
+        # screen has scrolled by, the start address is back at 0 and
+        # memory is the frame in order again.
+        for start in range(0, height, self.scroll_step):
+            end = min(start+self.scroll_step, height)
+            y0, y1 = (height-end, height-start) if from_top else (start, end)
+            self.set_frame(0, y0, width-1, y1-1)
+            self.data(frame[y0:y1].astype('>u2').tobytes())
+            self.vertical_scroll(y0 if from_top else y1 % height)
+        self._shown = frame
+
+    def vertical_scroll(self, line):
+        """Show memory from line at the top of the screen, wrapping round."""
+        self.commands(((ILI9341_VSCRSADD, [line >> 8, line & 0xFF]),))
 
     def penprint(self, position, size, color=(0,0,0) ):
         x=position[0]
@@ -267,6 +382,8 @@ class TFT24T():
         self.set_frame(x, y-size, x+size, y+size)
         pixelbytes=[0]*(size*size*8)
         self.data(pixelbytes)
+        # The screen no longer matches the last frame pushed
+        self._shown = None
 
 
     def clear(self, color=(0,0,0)):
@@ -318,17 +435,14 @@ class TFT24T():
         if self._led is not None:
             self._gpio.output(self._led, onoff)
 
+    def image_to_pixels(self, image):
+        """Convert a PIL image to an array of 16-bit 565 RGB pixels."""
+        rgb = np.asarray(image.convert('RGB'), dtype=np.uint16)
+        return ((rgb[...,0] & 0xF8) << 8) | ((rgb[...,1] & 0xFC) << 3) | (rgb[...,2] >> 3)
+
     def image_to_data(self, image):
-        """Generator function to convert a PIL image to 16-bit 565 RGB bytes."""
-        # Source of this code: Adafruit ILI9341 python project
-        pixels = image.convert('RGB').load()
-        width, height = image.size
-        for y in range(height):
-            for x in range(width):
-                r,g,b = pixels[(x,y)]
-                color = ((r & 0xF8) << 8) | ((g & 0xFC) << 3) | (b >> 3)
-                yield (color >> 8) & 0xFF
-                yield color & 0xFF
+        """Convert a PIL image to 16-bit 565 RGB bytes."""
+        return self.image_to_pixels(image).astype('>u2').tobytes()
 
 
     def textdirect(self, pos, text, font, fill="white"):
@@ -340,10 +454,9 @@ class TFT24T():
         textdraw = ImageDraw.Draw(textimage)
         textdraw.text((0,0), text, font=font, fill=fill)
         self.set_frame(pos[0], pos[1], pos[0]+width-1, pos[1]+height-1)
-        # Convert image to array of 16bit 565 RGB data bytes.
-        pixelbytes = list(self.image_to_data(textimage))
-        # Write data to hardware.
-        self.data(pixelbytes)
+        # Convert image to 16bit 565 RGB data bytes and write them to hardware.
+        self.data(self.image_to_data(textimage))
+        self._shown = None
 
     def penOnHotspot(self, HSlist, pos):
         # HotSpot list of "hotspots" - of form   [(x0,y0,x1,y1,returnvalue)]*numOfSpots
@@ -0,0 +1 @@
+../scingest/timeline.py
\ No newline at end of file
@@ -1,23 +1,20 @@
 #!/usr/bin/env python3
-try:
-	from RPi import GPIO
-except RuntimeError:
-	pass
 import atexit
 import termios, tty, sys
 import logging
 
 class Button(object):
 	"""a physical button"""
-	def __init__(self, pin):
+	def __init__(self, pin, gpio):
 		super(Button, self).__init__()
 		self.pin = pin
-		GPIO.setup(pin, GPIO.IN, pull_up_down=GPIO.PUD_UP)
+		self.gpio = gpio
+		gpio.setup(pin, gpio.IN, pull_up_down=gpio.PUD_UP)
 
 	def listen(self, callback):
-		GPIO.add_event_detect(self.pin, GPIO.FALLING, callback=callback, bouncetime=200)
+		self.gpio.add_event_detect(self.pin, self.gpio.FALLING, callback=callback, bouncetime=200)
 	def stop_listening(self):
-		GPIO.remove_event_detect(self.pin)
+		self.gpio.remove_event_detect(self.pin)
 
 
 
@@ -25,16 +22,18 @@ class Button_Interface(object):
 	"""using Pi's GPIO for interacting"""
 	def __init__(self, pins):
 		super(Button_Interface, self).__init__()
+		from RPi import GPIO # only on the Pi, and not before the buttons are set up
+		self.gpio = GPIO
 		self.pins = pins
 		self.buttons = []
 		GPIO.setmode(GPIO.BOARD)
 		atexit.register(self.cleanup)
 		#GPIO.setup(pins, GPIO.IN, pull_up_down=GPIO.PUD_UP)
 		for p in pins:
-			self.buttons.append(Button(p))
+			self.buttons.append(Button(p, GPIO))
 
 	def cleanup(self):
-		GPIO.cleanup()
+		self.gpio.cleanup()
 
 	def listen(self, event_callback):
 		"""Synchronously waits for main button press
@@ -47,7 +46,7 @@ class Button_Interface(object):
 		for b in menu_btns:
 			b.listen(self.button_press)
 		logging.debug("waiting for scan button")
-		GPIO.wait_for_edge(SCAN_BTN, GPIO.FALLING)
+		self.gpio.wait_for_edge(SCAN_BTN, self.gpio.FALLING)
 		logging.debug("scan button pressed")
 		logging.debug("disabling buttons")
 		for b in menu_btns:
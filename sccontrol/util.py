@@ -1,5 +1,7 @@
 #!/usr/bin/env python3
 import os
+import time
+from functools import lru_cache
 from PIL import ImageFont
 
 def is_pi():
@@ -8,7 +10,7 @@ def is_pi():
 def circle(x,y,r):
 	return (x-r,y-r,x+r,y+r)
 
-def document(d,x,y,n,backside=False,active=False):
+def document(d,x,y,n,backside=False,active=False,dropped=False):
 	ratio=(8.5,11)
 	scale=1.5
 
@@ -38,14 +40,47 @@ def document(d,x,y,n,backside=False,active=False):
 		d.polygon(pts, fill="white")
 	else:
 		d.polygon(pts, outline="white")
+	if dropped:
+		d.line((x,y,x+w,y+h),fill="white",width=1)
+		d.line((x+w,y,x,y+h),fill="white",width=1)
+		return
 	d.text((x+w/2,y+h/2),str(n),fill="black" if active else "white",font=loadfont("tiny.ttf",6))
 
+@lru_cache(maxsize=None)
 def loadfont(name, size=12):
 		fontp = os.path.abspath(os.path.join(
 			os.path.dirname(__file__),
 			'fonts', name))
 		return ImageFont.truetype(fontp, size)
 
+class lazyfont(object):
+	"""a font as a class attribute, loaded when first used rather than at import"""
+	def __init__(self, name, size=12):
+		super(lazyfont, self).__init__()
+		self.name = name
+		self.size = size
+	def __get__(self, obj, cls):
+		return loadfont(self.name, self.size)
+
+class phases(object):
+	"""wall time taken by each phase of something, for a report"""
+	def __init__(self, start=None):
+		super(phases, self).__init__()
+		self.start = self.last = time.time() if start is None else start
+		self.times = []
+	def mark(self, name):
+		"""phase name ends now"""
+		now = time.time()
+		self.times.append((name, now-self.last))
+		self.last = now
+	def add(self, name, seconds):
+		"""a phase that ran alongside the others"""
+		self.times.append((name+" (background)", seconds))
+	def report(self):
+		return "{}; {:.0f} ms in all".format(
+			", ".join("{} {:.0f} ms".format(name, t*1000) for name,t in self.times),
+			(self.last-self.start)*1000)
+
 class screen_timeout(object):
 	"""simple context manager for controlling a screen sleep time"""
 	def __init__(self, screen, t=5):
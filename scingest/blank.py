@@ -0,0 +1,24 @@
+import numpy as np
+
+# pixels darker than this (0-255) count as ink rather than paper
+INK_LEVEL = 160
+
+
+def ink_coverage(image, margin=5.0):
+    """percentage of the page, inside margin percent of each edge, covered in ink
+
+    Edges are left out since shadows, hole punches and feed marks collect there.
+    """
+    w,h = image.size
+    mx,my = int(w*margin/100),int(h*margin/100)
+    inner = image.crop((mx, my, w-mx, h-my))
+    if inner.mode != 'L':
+        inner = inner.convert('L')
+    pixels = np.asarray(inner)
+    if pixels.size == 0:
+        return 0.0
+    return np.count_nonzero(pixels < INK_LEVEL) * 100.0 / pixels.size
+
+def is_blank(image, threshold=0.2, margin=5.0):
+    """True if less than threshold percent of the page has ink on it"""
+    return ink_coverage(image, margin) < threshold
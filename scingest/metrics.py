@@ -0,0 +1,168 @@
+"""
+Counters, histograms and gauges of where scan time goes, served in the
+Prometheus text format from a local HTTP endpoint:
+
+    curl localhost:9555/metrics
+
+Metrics may have labels, given as values in the order of their labelnames
+when recording: stage_seconds.observe(0.2, 'snap').
+"""
+
+import time
+import logging
+import resource
+import threading
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+PORT = 9555
+
+REGISTRY = []
+
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(k, v) for k,v in pairs) + '}'
+
+def _number(v):
+    return '+Inf' if v == float('inf') else repr(float(v))
+
+
+class Metric(object):
+    kind = None
+
+    def __init__(self, name, doc, labelnames=()):
+        super(Metric, self).__init__()
+        self.name = name
+        self.doc = doc
+        self.labelnames = tuple(labelnames)
+        self.values = {} # label values -> value
+        self.lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def samples(self):
+        """(suffix, labels, value) of each sample"""
+        with self.lock:
+            return [('', _labels(self.labelnames, k), v) for k,v in sorted(self.values.items())]
+
+    def render(self):
+        lines = ['# HELP {} {}'.format(self.name, self.doc), '# TYPE {} {}'.format(self.name, self.kind)]
+        for suffix,labels,value in self.samples():
+            lines.append('{}{}{} {}'.format(self.name, suffix, labels, _number(value)))
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    """a count that only goes up"""
+    kind = 'counter'
+
+    def __init__(self, name, doc, labelnames=()):
+        super(Counter, self).__init__(name, doc, labelnames)
+        if not self.labelnames:
+            self.values[()] = 0 # shown from the start
+
+    def inc(self, *labels, n=1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + n
+
+
+class Gauge(Metric):
+    """a value that goes up and down, or is read from fn when scraped"""
+    kind = 'gauge'
+
+    def __init__(self, name, doc, labelnames=(), fn=None):
+        super(Gauge, self).__init__(name, doc, labelnames)
+        self.fn = fn
+
+    def set(self, value, *labels):
+        with self.lock:
+            self.values[labels] = value
+
+    def samples(self):
+        if self.fn is not None:
+            self.set(self.fn())
+        return super(Gauge, self).samples()
+
+
+class Histogram(Metric):
+    """observations counted into buckets, with their sum"""
+    kind = 'histogram'
+    buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+    def __init__(self, name, doc, labelnames=(), buckets=None):
+        super(Histogram, self).__init__(name, doc, labelnames)
+        if buckets is not None:
+            self.buckets = tuple(buckets)
+        self.buckets += (float('inf'),)
+
+    def observe(self, value, *labels):
+        with self.lock:
+            counts,total = self.values.get(labels, ([0]*len(self.buckets), 0))
+            for i,bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self.values[labels] = counts,total+value
+
+    @contextmanager
+    def time(self, *labels):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.observe(time.time()-start, *labels)
+
+    def samples(self):
+        samples = []
+        with self.lock:
+            for k,(counts,total) in sorted(self.values.items()):
+                for bound,count in zip(self.buckets, counts):
+                    samples.append(('_bucket', _labels(self.labelnames, k, [('le', _number(bound))]), count))
+                samples.append(('_sum', _labels(self.labelnames, k), total))
+                samples.append(('_count', _labels(self.labelnames, k), counts[-1]))
+        return samples
+
+
+def render():
+    return '\n'.join(m.render() for m in REGISTRY) + '\n'
+
+
+class Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = render().encode('utf8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, fmt, *args):
+        logging.debug('metrics: ' + fmt % args)
+
+def serve(port=PORT, host='127.0.0.1'):
+    """serve /metrics from a thread of its own, only to this machine by default"""
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='metrics', daemon=True).start()
+    logging.info('metrics at http://{}:{}/metrics'.format(host, port))
+    return server
+
+
+# what scingest records
+
+stage_seconds = Histogram('scingest_stage_seconds',
+    'time spent in each stage: device open, setopts, start (feeding a page), snap, '
+    'write (encoding and saving a page), thumbnail, pyramid, encode (for the wire) and send',
+    ('stage',))
+pages = Counter('scingest_pages_total', 'pages saved')
+blank_pages = Counter('scingest_blank_pages_total', 'blank pages dropped')
+scans = Counter('scingest_scans_total', 'scans run, by result', ('result',))
+bytes_written = Counter('scingest_written_bytes_total', 'bytes of scans written to disk')
+bytes_sent = Counter('scingest_sent_bytes_total', 'bytes of thumbnails and tiles sent to clients')
+pages_per_minute = Gauge('scingest_pages_per_minute', 'pages saved a minute over the last scan, from the scan command')
+peak_rss = Gauge('scingest_peak_rss_bytes', 'peak resident memory',
+    fn=lambda: resource.getrusage(resource.RUSAGE_SELF).ru_maxrss*1024)
@@ -0,0 +1,131 @@
+import os
+import shutil
+import logging
+import tempfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, CancelledError, wait
+from PIL import Image
+from pyramid import TilePyramid
+import proto
+import metrics
+import timeline
+
+THUMB_SIZE = (240,320)
+
+
+def page_bytes(mode, size):
+    """memory PIL uses for a page (bilevel pages take a byte per pixel too)"""
+    return size[0] * size[1] * Image.getmodebands(mode)
+
+def make_thumbnail(image, size=THUMB_SIZE):
+    """RGB bytes of the page fit inside size, keeping its aspect ratio"""
+    if image.mode not in ('L','RGB'):
+        image = image.convert('L')
+    factor = min(image.size[0]//size[0], image.size[1]//size[1])
+    # cheap box reduction first, so the filtered resize is on a small image.
+    # Never the page itself: thumbnail() resizes in place, and the page is
+    # being saved and tiled at the same time
+    image = image.reduce(factor) if factor > 1 else image.copy()
+    image.thumbnail(size, Image.BILINEAR)
+    thumb = Image.new('RGB', size, 'white')
+    thumb.paste(image.convert('RGB'), ((size[0]-image.size[0])//2, (size[1]-image.size[1])//2))
+    return thumb.tobytes()
+
+
+class PageStore(object):
+    """Thumbnails and tile pyramids of scanned pages, indexed in scan order
+
+    Both are made in the background as pages are added and kept on disk,
+    in a hidden directory under tile_dir; the pages themselves are let go
+    once tiled. add() blocks while the pages waiting on the tiler take
+    more than budget bytes, so memory stays flat however long the scan.
+    Their timeline is recorded under scan, if given.
+    """
+
+    budget = 256*2**20 # bytes of full-resolution pages waiting to be tiled
+
+    def __init__(self, tile_dir=None, scan=None, budget=None):
+        super(PageStore, self).__init__()
+        self.scan = scan
+        if budget is not None:
+            self.budget = budget
+        self.dir = tempfile.mkdtemp(prefix='.pages-', dir=tile_dir)
+        self.pages = [] # (mode,size) of each page
+        self.thumbs = [] # future path of each page's raw thumbnail
+        self.waiting = deque() # (future pyramid, page bytes) of pages the tiler holds, oldest first
+        self.held = 0
+        self.worker = ThreadPoolExecutor(max_workers=1)
+        self.pyramids = [] # future TilePyramid of each page
+        self.tiler = ThreadPoolExecutor(max_workers=1)
+
+    def __len__(self):
+        return len(self.pages)
+
+    def add(self, image):
+        index = len(self.pages)
+        self.pages.append((image.mode, image.size))
+        self.thumbs.append(self.worker.submit(self._thumbnail, index, image))
+        self.pyramids.append(self.tiler.submit(self._build_pyramid, index, image))
+        self.waiting.append((self.pyramids[index], page_bytes(image.mode, image.size)))
+        self.held += self.waiting[-1][1]
+        # the tiler holds on to pages until done, don't let it fall far behind
+        while self.waiting and (self.waiting[0][0].done() or self.held > self.budget and len(self.waiting) > 1):
+            job,size = self.waiting.popleft()
+            wait([job]) # a failed pyramid shows when its tiles are asked for
+            self.held -= size
+        return index
+
+    def thumbnail(self, index, encoding=proto.RAW):
+        raw = self._result(self.thumbs[index])
+        if encoding == proto.RAW:
+            return self._read(raw)
+        path = '{}.{}'.format(raw[:-len('.raw')], encoding.replace(':','-'))
+        if not os.path.exists(path):
+            with metrics.stage_seconds.time('encode'), timeline.timed(self.scan, 'encode', page=index, encoding=encoding):
+                self._write(path, proto.encode_image(self._read(raw), THUMB_SIZE, encoding))
+        return self._read(path)
+
+    def levels(self, index):
+        """(columns,rows) of tiles at each zoom level, 0 being full resolution"""
+        return self._result(self.pyramids[index]).levels
+
+    def tile(self, index, level, x, y):
+        return self._result(self.pyramids[index]).tile(level, x, y)
+
+    def close(self):
+        logging.debug('removing page store {}'.format(self.dir))
+        for job in self.thumbs + self.pyramids:
+            job.cancel()
+        self.worker.shutdown()
+        self.tiler.shutdown()
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def _result(self, job):
+        try:
+            return job.result()
+        except CancelledError:
+            raise OSError('page store closed')
+
+    def _read(self, path):
+        with open(path, 'rb') as f:
+            return f.read()
+
+    def _write(self, path, data):
+        # complete or not there at all, for another client asking at the same time
+        fd,tmp = tempfile.mkstemp(dir=self.dir)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+    def _thumbnail(self, index, image):
+        path = os.path.join(self.dir, 'thumb-{}.raw'.format(index))
+        with metrics.stage_seconds.time('thumbnail'), timeline.timed(self.scan, 'thumbnail', page=index):
+            self._write(path, make_thumbnail(image))
+        return path
+
+    def _build_pyramid(self, index, image):
+        pyramid = TilePyramid(os.path.join(self.dir, 'tiles-{}'.format(index)))
+        with metrics.stage_seconds.time('pyramid'), timeline.timed(self.scan, 'pyramid', page=index):
+            pyramid.build(image)
+        return pyramid
+
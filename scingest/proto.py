@@ -0,0 +1,141 @@
+"""
+Message framing shared by scingest and sccontrol (sccontrol/proto.py links here).
+
+Every message is a 4-byte big-endian length followed by that many bytes.
+Payloads are received straight into a buffer of the right size and sent
+together with their header in one gathered write, so neither side copies
+a thumbnail or page just to frame it.
+
+Image payloads (thumbnails and tiles) are RGB, in an encoding the client
+picks at connect time by sending {"hello": {"encodings": [...]}} with the
+encodings it accepts, best first. scingest answers "encoding:<spec>" with
+the first it supports. Clients that never say hello get raw.
+
+rgb565 is not RGB at all but the TFT's own framebuffer format: the image
+turned upside down for how the panel is mounted, as big-endian 5-6-5 bit
+pixels, so sccontrol can write it to the display without touching it.
+"""
+
+import io
+import json
+import zlib
+import asyncio
+import numpy as np
+from PIL import Image
+
+HEADER = 4
+
+
+def header(length):
+    return length.to_bytes(HEADER, byteorder='big')
+
+def recv_into(sock, view):
+    """fill view from sock, False if the peer closed first"""
+    got = 0
+    while got < len(view):
+        n = sock.recv_into(view[got:])
+        if n == 0:
+            return False
+        got += n
+    return True
+
+def recv(sock):
+    """next message as a bytearray, or None once the peer has closed"""
+    head = bytearray(HEADER)
+    if not recv_into(sock, memoryview(head)):
+        return None
+    msg = bytearray(int.from_bytes(head, byteorder='big'))
+    if not recv_into(sock, memoryview(msg)):
+        return None
+    return msg
+
+def send(sock, data):
+    head = header(len(data))
+    body = memoryview(data)
+    sent = sock.sendmsg([head, body])
+    if sent < HEADER:
+        sock.sendall(head[sent:])
+        sent = HEADER
+    sock.sendall(body[sent-HEADER:])
+
+def send_str(sock, s):
+    send(sock, s.encode('utf8'))
+
+def send_json(sock, obj):
+    send_str(sock, json.dumps(obj))
+
+
+# asyncio streams, for scingest's server
+
+async def read(reader):
+    """next message from a StreamReader, or None once the peer has closed"""
+    try:
+        head = await reader.readexactly(HEADER)
+        return await reader.readexactly(int.from_bytes(head, byteorder='big'))
+    except (asyncio.IncompleteReadError, ConnectionError):
+        return None
+
+def write(writer, data):
+    writer.writelines((header(len(data)), data))
+
+
+# image payload encodings, given as "<name>" or "<name>:<quality>"
+
+RAW = 'raw'
+ENCODINGS = {
+    'raw': None,
+    'zlib': None,
+    'jpeg': 75, # default quality
+    'rgb565': None,
+}
+
+def parse_encoding(spec):
+    name,_,quality = spec.partition(':')
+    if name not in ENCODINGS:
+        raise ValueError('unknown encoding {}'.format(spec))
+    return name,int(quality) if quality else ENCODINGS[name]
+
+def choose_encoding(offered):
+    """the first of the offered encodings we support"""
+    for spec in offered:
+        try:
+            parse_encoding(spec)
+        except ValueError:
+            continue
+        return spec
+    return RAW
+
+def encode_image(data, size, spec):
+    """encode raw RGB image bytes"""
+    name,quality = parse_encoding(spec)
+    if name == 'zlib':
+        return zlib.compress(data)
+    if name == 'jpeg':
+        buf = io.BytesIO()
+        Image.frombytes('RGB', size, data).save(buf, 'JPEG', quality=quality)
+        return buf.getvalue()
+    if name == 'rgb565':
+        return to_rgb565(data, size)
+    return data
+
+def to_rgb565(data, size):
+    """RGB bytes rotated 180 degrees and packed as the TFT's 16-bit pixels"""
+    w,h = size
+    rgb = np.frombuffer(data, dtype=np.uint8).reshape(h, w, 3)[::-1, ::-1].astype(np.uint16)
+    pixels = ((rgb[...,0] & 0xF8) << 8) | ((rgb[...,1] & 0xFC) << 3) | (rgb[...,2] >> 3)
+    return pixels.astype('>u2').tobytes()
+
+def decode_image(data, size, spec):
+    """raw RGB image bytes from an encoded payload
+
+    rgb565 is passed through as it is, for the display to take directly.
+    """
+    name,_ = parse_encoding(spec)
+    if not data:
+        return data # scingest's reply to a bad request
+    if name == 'zlib':
+        return zlib.decompress(data)
+    if name == 'jpeg':
+        with Image.open(io.BytesIO(data)) as im:
+            return im.tobytes()
+    return data
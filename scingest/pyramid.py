@@ -0,0 +1,55 @@
+import os
+import logging
+from PIL import Image
+
+TILE_SIZE = (240,320)
+
+
+class TilePyramid(object):
+    """A page cut into fixed-size tiles at halving resolutions
+
+    Level 0 is the full resolution page, each level up is half the size
+    of the one below, ending at the first level that fits in one tile.
+    Tiles are kept as separate JPEG files, so serving a region only ever
+    decodes the one tile covering it.
+    """
+
+    quality = 90
+
+    def __init__(self, directory, tile_size=TILE_SIZE):
+        super(TilePyramid, self).__init__()
+        self.dir = directory
+        self.tile_size = tile_size
+        self.levels = [] # (columns,rows) of tiles at each level
+        os.makedirs(directory, exist_ok=True)
+
+    def build(self, image):
+        if image.mode not in ('L','RGB'):
+            image = image.convert('L')
+        tw,th = self.tile_size
+        while True:
+            w,h = image.size
+            cols,rows = -(-w//tw),-(-h//th)
+            level = len(self.levels)
+            for y in range(rows):
+                for x in range(cols):
+                    box = (x*tw, y*th, min((x+1)*tw,w), min((y+1)*th,h))
+                    tile = Image.new(image.mode, self.tile_size, 'white')
+                    tile.paste(image.crop(box))
+                    tile.save(self._path(level,x,y), 'JPEG', quality=self.quality)
+            self.levels.append((cols,rows))
+            logging.debug('built pyramid level {}: {}x{} tiles'.format(level,cols,rows))
+            if cols == 1 and rows == 1:
+                break
+            image = image.reduce(2)
+
+    def tile(self, level, x, y):
+        """RGB bytes of one tile"""
+        cols,rows = self.levels[level] if level >= 0 else (0,0)
+        if not (0 <= x < cols and 0 <= y < rows):
+            raise IndexError('no tile {},{} at level {}'.format(x,y,level))
+        with Image.open(self._path(level,x,y)) as tile:
+            return tile.convert('RGB').tobytes()
+
+    def _path(self, level, x, y):
+        return os.path.join(self.dir, '{}-{}-{}.jpg'.format(level,x,y))
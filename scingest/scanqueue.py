@@ -0,0 +1,76 @@
+import asyncio
+import logging
+from collections import deque
+
+
+class ScanJob(object):
+    """A scan request waiting for the scanner"""
+    def __init__(self, options, notify, alive):
+        super(ScanJob, self).__init__()
+        self.options = options
+        self.notify = notify
+        self.alive = alive
+        self.result = asyncio.get_event_loop().create_future()
+
+
+class ScanQueue(object):
+    """Pending scans, run one at a time with sole use of the scanner
+
+    Jobs run back-to-back on the device thread without closing the device
+    in between; it is released only once the queue is empty. Waiting jobs
+    are sent "queued:<n>" with the number of jobs ahead of them whenever
+    that changes.
+    """
+    def __init__(self, scan, release, device):
+        super(ScanQueue, self).__init__()
+        self.scan = scan
+        self.release = release
+        self.device = device # single-thread executor owning the scanner
+        self.pending = deque()
+        self.current = None
+        self.wakeup = asyncio.Event()
+
+    def __len__(self):
+        return len(self.pending)
+
+    def submit(self, options, notify, alive=lambda: True):
+        job = ScanJob(options, notify, alive)
+        ahead = len(self.pending) + (self.current is not None)
+        if ahead:
+            notify("queued", str(ahead))
+        self.pending.append(job)
+        self.wakeup.set()
+        return job.result
+
+    async def run(self):
+        loop = asyncio.get_event_loop()
+        while True:
+            await self.wakeup.wait()
+            self.wakeup.clear()
+            if not self.pending:
+                continue # jobs that arrived during the last run
+            while self.pending:
+                self.current = self.pending.popleft()
+                self._report_positions()
+                await self._run_job(loop, self.current)
+                self.current = None
+            logging.debug('scan queue empty, releasing scanner')
+            await loop.run_in_executor(self.device, self.release)
+
+    async def _run_job(self, loop, job):
+        if not job.alive():
+            logging.debug('client left the queue, skipping its scan')
+            job.result.cancel()
+            return
+        try:
+            result = await loop.run_in_executor(self.device, self.scan, job.options, job.notify)
+        except Exception as e:
+            job.result.set_exception(e)
+        else:
+            job.result.set_result(result)
+
+    def _report_positions(self):
+        ahead = 0 if self.current is None else 1
+        for job in self.pending:
+            job.notify("queued", str(ahead))
+            ahead += 1
@@ -0,0 +1,331 @@
+#!/usr/bin/env python3
+"""
+Benchmarks for scingest. Run on the scan host, from this directory:
+
+    ./scbench.py tiff [pages] [dpi]
+    ./scbench.py pagestore [pages] [dpi] [budget MB]
+    ./scbench.py thumbnail [pages] [dpi]
+    ./scbench.py clients [pages] [others] [port]
+    ./scbench.py handle [repeats]            (needs the scanner)
+    ./scbench.py pipeline [pages] [dpi] [feed ms]
+    ./scbench.py writers [pages]
+    ./scbench.py proto [thumbnails] [pages]
+"""
+
+import os
+import sys
+import time
+import tempfile
+import resource
+import socket
+import threading
+import subprocess
+from PIL import Image, ImageDraw, TiffImagePlugin
+import scingest
+from pagestore import PageStore
+from writers import WRITERS, TiffWriter
+import proto
+from proto import send_json as sendjson, send_str as send, recv
+
+
+def make_page(dpi, mode='RGB'):
+    """a letter-sized page, mostly white with some lines of 'text'"""
+    w,h = int(8.5*dpi),int(11*dpi)
+    page = Image.new(mode, (w,h), 'white')
+    draw = ImageDraw.Draw(page)
+    line = max(1, dpi//8)
+    for y in range(dpi, h-dpi, line*2):
+        draw.rectangle((dpi, y, w-dpi-(y*7 % (w//3)), y+line//2), fill='black')
+    return page
+
+
+class FakeDev(object):
+    def __init__(self, dpi):
+        super(FakeDev, self).__init__()
+        self.resolution = dpi
+
+class FakeFeed(object):
+    """hands out copies of one page, noting when the feeder ran dry"""
+    def __init__(self, page, count, dpi, feed_time=0):
+        super(FakeFeed, self).__init__()
+        self.page = page
+        self.remaining = count
+        self.dev = FakeDev(dpi)
+        self.feed_time = feed_time
+        self.ended = None
+    def __iter__(self):
+        return self
+    def __next__(self):
+        if self.remaining == 0:
+            self.ended = time.time()
+            raise StopIteration
+        self.remaining -= 1
+        time.sleep(self.feed_time)
+        return self.page.copy()
+
+class BenchScanner(scingest.Scanner):
+    """Scanner that never touches SANE"""
+    def __init__(self, output_dir):
+        self.handle = None
+        self.output_dir = output_dir
+
+
+def legacy_scanwrite(feed, filename):
+    """uncompressed append, then re-compress the whole file with ImageMagick"""
+    with TiffImagePlugin.AppendingTiffWriter(filename,new=True) as tiff:
+        for page in feed:
+            page.save(tiff,dpi=(feed.dev.resolution,feed.dev.resolution))
+            tiff.newFrame()
+    subprocess.run(["convert","-compress","zip",filename,filename])
+
+
+def bench_tiff(pages=20, dpi=300):
+    page = make_page(dpi)
+    print("{} pages at {} dpi".format(pages, dpi))
+    with tempfile.TemporaryDirectory() as tmp:
+        scanner = BenchScanner(tmp)
+        for name in ('legacy','streaming'):
+            base = os.path.join(tmp, name)
+            path = base+'.tiff'
+            feed = FakeFeed(page, pages, dpi)
+            start = time.time()
+            if name == 'legacy':
+                legacy_scanwrite(feed, path)
+            else:
+                store = PageStore(tmp)
+                with TiffWriter(base, dpi) as writer:
+                    scanner.scanwrite(feed, writer, scingest.NOOP, store)
+                store.close()
+            done = time.time()
+            print("{:>10}: total {:7.2f}s, end-of-feed to complete {:6.2f}s, {:7.1f} MB".format(
+                name, done-start, done-feed.ended, os.path.getsize(path)/2**20))
+
+
+def bench_pagestore(pages=40, dpi=300, budget=256):
+    page = make_page(dpi)
+    print("{} pages at {} dpi, {} MB budget".format(pages, dpi, budget))
+    with tempfile.TemporaryDirectory() as tmp:
+        store = PageStore(tmp, budget=budget*2**20)
+        for i,p in enumerate(FakeFeed(page, pages, dpi)):
+            store.add(p)
+            if (i+1) % 10 == 0:
+                rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+                print("{:4d} pages: peak RSS {:7.1f} MB".format(i+1, rss/1024))
+        for i in range(len(store)):
+            store.levels(i) # wait for the pyramids
+        start = time.time()
+        for i in range(len(store)):
+            cols,rows = store.levels(i)[0]
+            store.tile(i, 0, cols//2, rows//2)
+        print("full resolution tile: {:.1f} ms/page".format((time.time()-start)*1000/len(store)))
+        store.close()
+
+
+def bench_thumbnail(pages=10, dpi=500):
+    page = make_page(dpi)
+    print("{} pages at {} dpi".format(pages, dpi))
+    start = time.time()
+    for i in range(pages):
+        page.resize((240,320)).convert('RGB').tobytes()
+    print("resize at request time: {:8.2f} ms/page".format((time.time()-start)*1000/pages))
+    with tempfile.TemporaryDirectory() as tmp:
+        store = PageStore(tmp)
+        start = time.time()
+        for p in FakeFeed(page, pages, dpi):
+            store.add(p)
+        store.thumbnail(pages-1)
+        print("  background thumbnail: {:8.2f} ms/page".format((time.time()-start)*1000/pages))
+        start = time.time()
+        for i in range(pages):
+            store.thumbnail(i)
+        print("    cached page request: {:8.4f} ms/page".format((time.time()-start)*1000/pages))
+        store.close()
+
+
+def fake_scan(pages, dpi, feed_time, tile_dir):
+    """a Server callback that feeds pages at a fixed rate, like the ADF"""
+    page = make_page(dpi)
+    def scan(options, client_notify):
+        store = PageStore(tile_dir)
+        for i,p in enumerate(FakeFeed(page, pages, dpi)):
+            client_notify("feed start")
+            time.sleep(feed_time)
+            client_notify("page fed")
+            client_notify("PAGE {}".format(i+1))
+            store.add(p)
+        client_notify("complete")
+        return True,store
+    return scan
+
+def connect(port):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.connect(("localhost",port))
+    return sock
+
+def scan_rate(port, pages):
+    sock = connect(port)
+    start = time.time()
+    sendjson(sock, {"scan":True,"options":{}})
+    msg = recv(sock)
+    while msg is not None and msg != b'complete':
+        msg = recv(sock)
+    sock.close()
+    return pages*60/(time.time()-start)
+
+def monitor(port, stop, dropped):
+    """another client, asking for status and thumbnails as fast as it can"""
+    sock = connect(port)
+    while not stop.is_set():
+        sendjson(sock, {"status":True})
+        status = recv(sock)
+        send(sock, "0")
+        if status is None or recv(sock) is None:
+            dropped.append(port)
+            break
+    sock.close()
+
+# a scan with other clients connected may be no slower than this, relative to alone
+MIN_CLIENTS_RATIO = 0.9
+
+def bench_clients(pages=10, others=10, port=5556):
+    """one client's scan rate alone and with others browsing, failing if it drops"""
+    with tempfile.TemporaryDirectory() as tmp:
+        server = scingest.Server(port)
+        server.onconnect(fake_scan(pages, 150, 0.5, tmp))
+        threading.Thread(target=server.listen, daemon=True).start()
+        time.sleep(0.5)
+        scan_rate(port, pages) # leaves a scan for the monitors to browse
+        alone = scan_rate(port, pages)
+        stop = threading.Event()
+        dropped = []
+        monitors = [threading.Thread(target=monitor, args=(port, stop, dropped)) for i in range(others)]
+        for m in monitors:
+            m.start()
+        busy = scan_rate(port, pages)
+        stop.set()
+        for m in monitors:
+            m.join()
+        print("scan alone: {:6.1f} pages/min".format(alone))
+        print("with {} other clients: {:6.1f} pages/min ({:.0%})".format(others, busy, busy/alone))
+        assert not dropped, "{} of the other clients were dropped".format(len(dropped))
+        assert busy >= alone*MIN_CLIENTS_RATIO, "scanning slowed to {:.0%} with other clients".format(busy/alone)
+
+
+def bench_handle(repeats=5):
+    """device setup before a scan: a fresh handle every time vs a kept one"""
+    sys.argv[1:] = [] # Scanner takes its output dir from the command line
+    scanner = scingest.Scanner()
+    options = [{'resolution':300}, {'resolution':300}, {'resolution':200,'mode':'Gray'}]
+    for name in ('reopen','persistent'):
+        times = []
+        for i in range(repeats):
+            for opts in options:
+                if name == 'reopen':
+                    scanner.disconnect()
+                start = time.time()
+                scanner.prepare(opts)
+                times.append(time.time()-start)
+        print("{:>10}: {:6.1f} ms mean, {:6.1f} ms max".format(
+            name, sum(times)*1000/len(times), max(times)*1000))
+    scanner.disconnect()
+
+
+def bench_pipeline(pages=10, dpi=300, feed_ms=1000):
+    page = make_page(dpi)
+    print("{} pages at {} dpi, {} ms per page from the feeder".format(pages, dpi, feed_ms))
+    with tempfile.TemporaryDirectory() as tmp:
+        scanner = BenchScanner(tmp)
+        for depth in (0,1,2,4):
+            feed = FakeFeed(page, pages, dpi, feed_ms/1000)
+            if depth:
+                feed = scingest.PagePipeline(feed, depth)
+            store = PageStore(tmp)
+            start = time.time()
+            with TiffWriter(os.path.join(tmp, 'scan'), dpi) as writer:
+                scanner.scanwrite(feed, writer, scingest.NOOP, store)
+            rate = pages*60/(time.time()-start)
+            store.close()
+            if depth:
+                feed.close()
+                print("depth {}: {:6.1f} pages/min, feeder blocked {:5.1f}s, saver starved {:5.1f}s".format(
+                    depth, rate, feed.blocked, feed.starved))
+            else:
+                print(" serial: {:6.1f} pages/min".format(rate))
+
+
+def bench_writers(pages=2):
+    """bytes and encode time per page for each output format, at each resolution sccontrol offers"""
+    print("{:>5} {:>6} {:>10} {:>10}".format("dpi", "format", "KB/page", "ms/page"))
+    with tempfile.TemporaryDirectory() as tmp:
+        for dpi in range(50, 601, 50):
+            page = make_page(dpi)
+            for name,cls in WRITERS.items():
+                start = time.time()
+                with cls(os.path.join(tmp, '{}-{}'.format(name,dpi)), dpi) as writer:
+                    for i in range(pages):
+                        writer.write(page)
+                elapsed = time.time()-start
+                print("{:5d} {:>6} {:10.1f} {:10.1f}".format(
+                    dpi, name, writer.size()/1024/pages, elapsed*1000/pages))
+                writer.remove()
+
+
+def legacy_send(sock, data):
+    msglen = len(data).to_bytes(4, byteorder='big')
+    sock.send(msglen+data)
+
+def legacy_recv(sock):
+    pkt_len = sock.recv(4)
+    if pkt_len == b'':
+        return None
+    pkt_len = int.from_bytes(pkt_len, byteorder='big')
+    nbytes=0
+    chunks=[]
+    while nbytes < pkt_len:
+        chunk = sock.recv(min(pkt_len - nbytes, 2048))
+        if chunk == b'':
+            return None
+        chunks.append(chunk)
+        nbytes += len(chunk)
+    return b''.join(chunks)
+
+def bench_proto(thumbnails=500, pages=5):
+    """message throughput over a local socket pair"""
+    sizes = (('thumbnail', 240*320*3, thumbnails), ('page', 4250*5500*3, pages))
+    impls = (('legacy', legacy_send, legacy_recv), ('proto', proto.send, proto.recv))
+    for label,size,count in sizes:
+        data = bytes(size)
+        for name,sendf,recvf in impls:
+            a,b = socket.socketpair()
+            def sender():
+                for i in range(count):
+                    sendf(a, data)
+            t = threading.Thread(target=sender)
+            start = time.time()
+            t.start()
+            got = 0
+            for i in range(count):
+                got += len(recvf(b))
+            t.join()
+            elapsed = time.time()-start
+            a.close()
+            b.close()
+            print("{:>9} {:>6}: {:8.1f} MB/s, {:8.2f} ms/message".format(
+                label, name, got/2**20/elapsed, elapsed*1000/count))
+
+
+if __name__ == "__main__":
+    benches = {
+        'tiff': bench_tiff,
+        'pagestore': bench_pagestore,
+        'thumbnail': bench_thumbnail,
+        'clients': bench_clients,
+        'handle': bench_handle,
+        'pipeline': bench_pipeline,
+        'writers': bench_writers,
+        'proto': bench_proto,
+    }
+    if len(sys.argv) < 2 or sys.argv[1] not in benches:
+        print("usage: {} [{}] [args...]".format(sys.argv[0], "|".join(benches)))
+        sys.exit(1)
+    benches[sys.argv[1]](*[int(a) for a in sys.argv[2:]])
@@ -1,17 +1,25 @@
 #!/usr/bin/env python3
 
 import sane
-from PIL import TiffImagePlugin
 import logging
-import socket
-import subprocess
+import asyncio
 import json
+import queue
+import threading
 from signal import signal, SIGTERM, SIGINT
 import atexit
 import sys, os
 import time
 import datetime
-import random
+from concurrent.futures import ThreadPoolExecutor
+import proto
+import metrics
+import timeline
+from pagestore import PageStore
+from pyramid import TILE_SIZE
+from scanqueue import ScanQueue
+from blank import is_blank
+from writers import WRITERS
 
 """
 Interesting options:
@@ -40,117 +48,183 @@ logging.basicConfig(level=logging.DEBUG,format="%(asctime)s %(levelname)7s : %(m
 NOOP = lambda *x, **y: None
 
 class Client(object):
-    """Communication with sccontrol client"""
-    def __init__(self, sock, addr):
+    """Communication with one sccontrol (or monitoring) client
+
+    Runs on the server's event loop. Each message is either a json
+    command or a page request against the most recent scan.
+    """
+    def __init__(self, reader, writer, server):
         super(Client, self).__init__()
-        self.sock = sock
-        self.addr = addr
-        atexit.register(self.cleanup)
-        logging.info("got connection from {}".format(addr))
+        self.reader = reader
+        self.writer = writer
+        self.server = server
+        self.loop = asyncio.get_event_loop()
+        self.addr = writer.get_extra_info('peername')
+        self.pages = None
+        self.last_page = None
+        self.scan_id = None # of the scan pages are requested from, see timeline
+        self.encoding = proto.RAW
+        logging.info("got connection from {}".format(self.addr))
 
     def cleanup(self):
         logging.debug("cleaning up client socket")
-        self.sock.close()
+        self.writer.close()
+        pages,self.pages = self.pages,None
+        self.server.release_pages(pages)
 
 
     def _sendb(self, data):
-        msglen = len(data).to_bytes(4, byteorder='big')
-        self.sock.send(msglen+data)
+        if self.writer.is_closing():
+            logging.debug("client socket closed")
+            return
+        proto.write(self.writer, data)
     def _send(self, string):
         self._sendb(string.encode('utf8'))
     def _sendjson(self, thing):
         return self._send(json.dumps(thing))
-    def _getmsg(self):
-        pkt_len = self.sock.recv(4)
-        if pkt_len == b'':
-            return None
-        pkt_len = int.from_bytes(pkt_len, byteorder='big')
-        nbytes=0
-        chunks=[]
-        while nbytes < pkt_len:
-            chunk = self.sock.recv(min(pkt_len - nbytes, 2048))
-            if chunk == b'':
-                return None
-            chunks.append(chunk)
-            nbytes += len(chunk)
-        return b''.join(chunks)
-
-
-    def _get_command(self):
-        msg = self._getmsg()
-        if msg is None:
-            return None,None
-        msg = json.loads(msg.decode('utf8'))
-        if type(msg) is not dict or 'scan' not in msg:
-            return None,None
-        scan = bool(msg['scan'])
-        opts = msg['options'] if 'options' in msg else {}
-        return scan,opts
-
-    def _get_data_req(self):
-        msg = self._getmsg()
-        if msg is None:
+    async def _getmsg(self):
+        return await proto.read(self.reader)
+
+
+    def _parse_command(self, msg):
+        try:
+            msg = json.loads(msg.decode('utf8'))
+        except ValueError:
             return None
-        page = int(msg.decode('utf8'))
-        return page
+        return msg if type(msg) is dict else None
+
+    def _get_data_req(self, msg):
+        return msg.decode('utf8').split(':')
 
 
-    def _send_page_data(self, data):
-        scaled_data = data.resize((240,320)).convert('RGB').tobytes()
-        self._sendb(scaled_data)
+    def _page_data(self, pages, page):
+        return pages.thumbnail(page, self.encoding)
 
-    def _send_crop_data(self, data):
-        w,h = data.size
-        x,y = random.randrange(w-240),random.randrange(h-320)
-        cropped_data = data.crop((x,y,x+240,y+320)).convert('RGB').tobytes()
-        self._sendb(cropped_data)
+    def _tile_data(self, pages, page, level, x, y):
+        tile = pages.tile(page, level, x, y)
+        with metrics.stage_seconds.time('encode'):
+            return proto.encode_image(tile, TILE_SIZE, self.encoding)
 
+    def _centre_tile(self, pages, page):
+        cols,rows = pages.levels(page)[0]
+        return self._tile_data(pages, page, 0, cols//2, rows//2)
+
+    # may be called from the scanning thread
     def send_progress(self, action, *args):
         logging.debug("** sending to client: {} : {}".format(action,args))
+        self.loop.call_soon_threadsafe(self._send, ":".join([action,*args]))
+
+    async def process(self):
         try:
-            self._send(":".join([action,*args]))
-        except BrokenPipeError:
+            msg = await self._getmsg()
+            while msg is not None:
+                cmd = self._parse_command(msg)
+                if cmd is not None:
+                    await self._run_command(cmd)
+                else:
+                    await self._serve_page(self._get_data_req(msg))
+                await self.writer.drain()
+                msg = await self._getmsg()
+        except ConnectionError:
             logging.debug("client socket closed")
-            pass
+        finally:
+            self.cleanup()
+        logging.debug('Client process complete')
 
-    def process(self, cb):
-        # client should contact us first with options
-        cmd,opts = self._get_command()
-        if not cmd:
-            return
+    # commands are json objects, one of
+    #   {"hello": {"encodings": [...]}}    pick an image encoding, see proto
+    #   {"scan": true, "options": {...}}   scan, then page requests are for this scan,
+    #                                      with "id": "<scan id>" to record its timeline
+    #   {"status": true}                   json status of the server
+    #   {"ping": true}                     answered "pong", for clients checking the connection
+    #   {"time": true}                     answered "time:<seconds since the epoch>"
+    #   {"timeline": "<scan id>"}          json list of the spans recorded for a scan
+    async def _run_command(self, cmd):
+        if 'hello' in cmd:
+            self.encoding = proto.choose_encoding(cmd['hello'].get('encodings', []))
+            logging.debug('client chose {} images'.format(self.encoding))
+            self._send("encoding:{}".format(self.encoding))
+        elif cmd.get('scan'):
+            opts = cmd['options'] if 'options' in cmd else {}
+            if 'id' in cmd:
+                opts = {**opts, 'scan_id': cmd['id']}
+            with timeline.timed(cmd.get('id'), 'scan command'):
+                success,pages = await self.server.scan(opts, self.send_progress, lambda: not self.writer.is_closing())
+            if not success:
+                logging.debug('scan did not produce images, skipping page-request')
+                return
+            logging.debug('scan produced images, listening for page requests')
+            old,self.pages = self.pages,pages
+            self.server.release_pages(old)
+            self.last_page = None
+            self.scan_id = cmd.get('id')
+        elif cmd.get('status'):
+            self._sendjson(self.server.status())
+        elif cmd.get('ping'):
+            self._send("pong")
+        elif cmd.get('time'):
+            self._send("time:{!r}".format(time.time()))
+        elif 'timeline' in cmd:
+            self._sendjson(timeline.take(cmd['timeline']))
+        else:
+            logging.debug('unknown command {}'.format(cmd))
 
-        success,data = cb(opts, self.send_progress)
-        if not success:
-            logging.debug('scan did not produce images, skipping page-request')
-            return
-        logging.debug('scan produced images, listening for page requests')
-        last_page = None
-        page = self._get_data_req()
-        while page != None:
-            logging.debug('got page request')
-            if page < 0 or page >= len(data):
-                logging.debug('page request out of range')
-                continue
-            if last_page != page:
-                logging.debug('sending page {}'.format(page))
-                self._send_page_data(data[page])
-            else:
-                logging.debug('already sent page {}, sending crop sample'.format(page))
-                self._send_crop_data(data[page])
-            last_page = page
-            logging.debug('listening for next page request')
-            page = self._get_data_req()
-        logging.debug('Client process complete')
+    async def _serve_page(self, req):
+        logging.debug('got page request {}'.format(req))
+        scan = None if self.pages is None else self.scan_id
+        with timeline.timed(scan, 'page request', req=':'.join(req)):
+            await self._answer_page(req)
+
+    async def _answer_page(self, req):
+        pages = self.server.latest if self.pages is None else self.pages
+        try:
+            if pages is None:
+                raise IndexError('no scan to request pages from')
+            data,self.last_page = await self.loop.run_in_executor(
+                None, self._answer_data_req, pages, req, self.last_page)
+        except (ValueError, IndexError, OSError):
+            logging.debug('bad page request')
+            data = b''
+        self._sendb(data)
+        with metrics.stage_seconds.time('send'):
+            await self.writer.drain()
+        metrics.bytes_sent.inc(n=len(data))
+
+    # requests are one of
+    #   <page>                        thumbnail, or full-res centre if asked twice
+    #   levels:<page>                 json list of [columns,rows] per zoom level
+    #   tile:<page>:<level>:<x>:<y>   240x320 tile, level 0 being full resolution
+    # runs in a worker thread, returning the reply and the page a repeat
+    # plain page request is compared against, which levels and tiles leave alone
+    def _answer_data_req(self, pages, req, last_page):
+        cmd = req[0] if req[0] in ('levels','tile') else 'page'
+        page,*args = [int(a) for a in (req if cmd == 'page' else req[1:])]
+        if page < 0 or page >= len(pages):
+            raise IndexError('page request out of range')
+        if cmd == 'levels':
+            return json.dumps(pages.levels(page)).encode('utf8'),last_page
+        elif cmd == 'tile':
+            level,x,y = args
+            return self._tile_data(pages, page, level, x, y),last_page
+        elif last_page != page:
+            logging.debug('sending page {}'.format(page))
+            return self._page_data(pages, page),page
+        else:
+            logging.debug('already sent page {}, sending full resolution centre'.format(page))
+            return self._centre_tile(pages, page),page
 
 
 
 
 class PageFeed(object):
     """Page iterator for ADF feed since python-sane doesn't do it right for python3"""
-    def __init__(self, dev, cb):
+    def __init__(self, dev, cb, since=None, scan=None):
         super(PageFeed, self).__init__()
         self.dev = dev
         self.client_notify = cb
+        self.since = time.time() if since is None else since
+        self.scan = scan
+        self.fed = 0
     def __iter__(self):
         return self
     def __del__(self):
@@ -174,13 +248,87 @@ class PageFeed(object):
                 # Document feeder jammed
                 raise
         end = time.time() - start
+        metrics.stage_seconds.observe(end, 'start')
+        timeline.record(self.scan, 'feed page', start, page=self.fed+1)
         if end < 2:
             logging.debug("Got backside")
             self.client_notify("backside")
         else:
             logging.debug("Page fed")
             self.client_notify("page fed")
-        return self.dev.snap(True)
+        self.fed += 1
+        if self.fed == 1:
+            logging.info("first page fed {:.2f}s after scan start".format(time.time()-self.since))
+        with metrics.stage_seconds.time('snap'), timeline.timed(self.scan, 'snap', page=self.fed):
+            return self.dev.snap(True)
+
+class PagePipeline(object):
+    """Runs a PageFeed on its own thread, handing pages over through a bounded queue
+
+    The scanner feeds the next page while the last one is being saved.
+    Once depth pages are waiting the feeder blocks (backpressure) rather
+    than piling up full-resolution pages in memory.
+    """
+
+    _END = object()
+
+    def __init__(self, feed, depth):
+        super(PagePipeline, self).__init__()
+        self.feed = feed
+        self.dev = feed.dev
+        self.depth = depth
+        self.queue = queue.Queue(maxsize=depth)
+        self.stopped = threading.Event()
+        self.thread = None
+        self.blocked = 0.0 # seconds the feeder waited on a full queue
+        self.starved = 0.0 # seconds the saver waited on an empty queue
+        self.high_water = 0
+
+    def __iter__(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._feed, name='feeder', daemon=True)
+            self.thread.start()
+        return self
+
+    def __next__(self):
+        start = time.time()
+        item = self.queue.get()
+        self.starved += time.time() - start
+        if item is self._END:
+            raise StopIteration
+        if isinstance(item, Exception):
+            raise item
+        return item
+
+    def _feed(self):
+        try:
+            for page in self.feed:
+                self._put(page)
+                if self.stopped.is_set():
+                    return
+        except Exception as e:
+            self._put(e)
+        else:
+            self._put(self._END)
+
+    def _put(self, item):
+        start = time.time()
+        while not self.stopped.is_set():
+            try:
+                self.queue.put(item, timeout=0.5)
+                break
+            except queue.Full:
+                pass
+        self.blocked += time.time() - start
+        self.high_water = max(self.high_water, self.queue.qsize())
+
+    def close(self):
+        """stop feeding, and wait for the feeder to let go of the device"""
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+        logging.debug("pipeline depth {}: feeder blocked {:.1f}s, saver starved {:.1f}s, max queued {}".format(
+            self.depth, self.blocked, self.starved, self.high_water))
 
 class Scanner(object):
     """SANE communication with scanner"""
@@ -191,20 +339,43 @@ class Scanner(object):
         'mode':'Color',
         'resolution':500,
         'ald':1,
-        'swskip':15.0,
+        'swskip':0.0, # blank pages are dropped by scingest instead, see local_defaults
         'swcrop':0,
         'swdeskew':1,
         'swdespeck':2,
     }
 
+    # options handled by scingest rather than the SANE backend
+    local_defaults={
+        'blank_threshold':0.2, # percent ink coverage under which a page is blank, 0 keeps all
+        'blank_margin':5.0, # percent of each edge ignored when looking for ink
+        'format':'tiff', # one of writers.WRITERS
+        'scan_id':None, # from the scan command, see timeline
+    }
+
+    # pages scanned ahead of the one being saved
+    pipeline_depth = 2
+
+    # full-resolution pages held waiting to be tiled, in MB from the
+    # command line: scingest.py [output dir] [page budget MB]
+    page_budget = 256*2**20
+
+    # keep the device open between scans. Changing these resets other
+    # options in the backend, so all options are sent again when they change
+    keep_open = True
+    reload_opts = ('mode','source')
+
     def __init__(self):
         super(Scanner, self).__init__()
         self.handle=None
+        self.applied={} # options as last set on the open handle
         sane.init()
         self.get_device('FUJITSU')
         logging.debug('got scanning device')
         atexit.register(self.cleanup)
         self.output_dir = "" if len(sys.argv) < 2 else sys.argv[1]
+        if len(sys.argv) > 2:
+            self.page_budget = int(sys.argv[2])*2**20
         os.makedirs(self.output_dir,exist_ok=True)
 
 
@@ -213,74 +384,140 @@ class Scanner(object):
         self.device = [x for x in devs if x[1] == manufac][0][0]
 
     def connect(self):
-        self.handle = sane.open(self.device)
+        if self.handle:
+            return self.handle
+        with metrics.stage_seconds.time('open'):
+            self.handle = sane.open(self.device)
+        self.applied = {}
         logging.debug("Connected to {}".format(self.device))
         return self.handle
 
     def disconnect(self):
         if self.handle:
             logging.debug("Closing handle to {}".format(self.device))
-            self.handle.close()
+            try:
+                self.handle.close()
+            except sane._sane.error as e:
+                logging.debug("handle did not close cleanly: {}".format(e))
             self.handle=None
+            self.applied={}
+
+    # called by Server when no more scans are queued
+    def release(self):
+        if not self.keep_open:
+            self.disconnect()
 
     def setopts(self, device, options):
+        with metrics.stage_seconds.time('setopts'):
+            self._setopts(device, options)
+
+    def _setopts(self, device, options):
         settings = {**self.defaults, **options}
+        if any(self.applied.get(opt) != settings.get(opt) for opt in self.reload_opts):
+            self.applied = {}
         for opt,val in settings.items():
+            if opt in self.applied and self.applied[opt] == val:
+                continue
             logging.debug('setting printer option {}={}'.format(opt,val))
             setattr(device,opt,val)
-
-    def removeFile(self, filename):
+            self.applied[opt] = val
+
+    def prepare(self, options):
+        """open (or reuse) the device and apply options, reconnecting once if the handle went bad"""
+        leftover = set(self.applied) - set(self.defaults) - set(options)
+        if leftover:
+            # set by an earlier scan with no default to put back, start from the backend's own
+            logging.debug("reopening device to reset {}".format(', '.join(sorted(leftover))))
+            self.disconnect()
+        reused = self.handle is not None
         try:
-            os.remove(filename)
-        except OSError:
-            pass
+            device = self.connect()
+            if reused:
+                device.mode # a handle gone stale (scanner power cycled, saned restarted) fails to read
+            self.setopts(device, options)
+        except sane._sane.error as e:
+            logging.info("device handle failed ({}), reconnecting".format(e))
+            self.disconnect()
+            device = self.connect()
+            self.setopts(device, options)
+        return device
+
+    def split_options(self, options):
+        """separate scingest's own options from those for the backend"""
+        local = {k:v for k,v in options.items() if k in self.local_defaults}
+        device = {k:v for k,v in options.items() if k not in self.local_defaults}
+        return {**self.local_defaults, **local},device
+
+    def scanwrite(self, feed, writer, client_notify, pages, settings=None):
+        settings = self.local_defaults if settings is None else settings
+        scan = settings['scan_id']
+        for i,page in enumerate(feed):
+            with timeline.timed(scan, 'blank check', page=i+1):
+                blank = is_blank(page, settings['blank_threshold'], settings['blank_margin'])
+            if blank:
+                logging.info('dropping blank page {}'.format(i+1))
+                client_notify("blank", str(i+1))
+                metrics.blank_pages.inc()
+                continue
+            logging.info('saving page {}...'.format(i+1))
+            client_notify("PAGE {}".format(i+1))
+            pages.add(page)
+            with metrics.stage_seconds.time('write'), timeline.timed(scan, 'write page', page=i+1):
+                writer.write(page)
+            metrics.pages.inc()
+            logging.debug("saved")
+
 
-    def scanwrite(self, feed, filename, client_notify):
-        logging.info("creating {}".format(filename))
-        pages=[]
-        with TiffImagePlugin.AppendingTiffWriter(filename,new=True) as tiff:
-            for i,page in enumerate(feed):
-                logging.info('saving page {}...'.format(i+1))
-                client_notify("PAGE {}".format(i+1))
-                page.save(tiff,dpi=(feed.dev.resolution,feed.dev.resolution))
-                tiff.newFrame()
-                pages.append(page)
-                logging.debug("saved")
-        subprocess.run(["convert","-compress","zip",filename,filename])
-        return pages
-
-
-    def perform_scan(self, device, client_notify):
+    def perform_scan(self, device, client_notify, since=None, settings=None):
+        settings = self.local_defaults if settings is None else settings
         now = datetime.datetime.now()
-        filename = "scan-{}.tiff".format(now.strftime("%Y%m%d%H%M%S_%f"))
-        path = os.path.join(self.output_dir, filename)
-        feeder = PageFeed(device, client_notify)
+        base = os.path.join(self.output_dir, "scan-{}".format(now.strftime("%Y%m%d%H%M%S_%f")))
+        pages = PageStore(self.output_dir, settings['scan_id'], self.page_budget)
+        if settings['format'] not in WRITERS:
+            logging.error("unknown output format {}".format(settings['format']))
+            client_notify("error","unknown format {}".format(settings['format']))
+            return False,pages
+        writer = WRITERS[settings['format']](base, device.resolution)
+        feeder = PagePipeline(PageFeed(device, client_notify, since, settings['scan_id']), self.pipeline_depth)
         try:
-            pages = self.scanwrite(feeder, path, client_notify)
+            try:
+                with writer:
+                    self.scanwrite(feeder, writer, client_notify, pages, settings)
+            finally:
+                feeder.close()
         except sane._sane.error as e:
             logging.error(str(e))
-            logging.info("aborting scan, removing file")
+            logging.info("aborting scan, removing files")
+            # the handle may not survive a failed feed, start fresh next time
+            self.disconnect()
             client_notify("error",str(e))
-            self.removeFile(path)
-            return False,[]
+            writer.remove()
+            return False,pages
         else:
-            if len(pages) == 0 or os.path.getsize(path) == 0:
-                logging.debug("empty scan file. Removing")
+            if len(pages) == 0 or writer.size() == 0:
+                logging.debug("empty scan. Removing files")
                 client_notify("empty scan")
-                self.removeFile(path)
+                writer.remove()
                 return False,pages
             else:
+                metrics.bytes_written.inc(n=writer.size())
                 client_notify("complete")
                 return True,pages
 
-    # called as callback in Client socket processing
+    # called as callback in Server, on its device thread
     def scan(self, options, client_notify=NOOP):
         logging.info('scan starting')
-        device = self.connect()
-        self.setopts(device, options)
-        success,images = self.perform_scan(device, client_notify)
+        start = time.time()
+        settings,options = self.split_options(options)
+        with timeline.timed(settings['scan_id'], 'device ready'):
+            device = self.prepare(options)
+        logging.info('device ready in {:.3f}s'.format(time.time()-start))
+        success,images = self.perform_scan(device, client_notify, start, settings)
+        timeline.record(settings['scan_id'], 'scan', start, success=success)
+        metrics.scans.inc('complete' if success else 'failed')
+        if success:
+            metrics.pages_per_minute.set(len(images)*60/(time.time()-start))
         logging.info('scan complete')
-        self.disconnect()
         return success,images
 
     def cleanup(self):
@@ -289,37 +526,81 @@ class Scanner(object):
         sane.exit()
 
 class Server(object):
-    """Socket listener"""
+    """Socket listener, serving any number of clients at once
+
+    Scans are queued and run one at a time on a dedicated thread, so the
+    event loop stays free for other clients' status and page requests.
+    A scan's pages are kept while it is the latest or some client's own.
+    """
     def __init__(self, port):
         super(Server, self).__init__()
         self.port = port
-        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        bound=False
-        while not bound:
-            try:
-                self.socket.bind(('',port))
-            except OSError:
-                logging.info("Socket in use, trying again")
-                time.sleep(1)
-            else:
-                bound=True
         self.launch = NOOP
-        logging.info('Server listening at port {}'.format(port))
+        self.release = NOOP
+        self.clients = set()
+        self.latest = None # PageStore of the most recent successful scan
+        self.device = ThreadPoolExecutor(max_workers=1)
         atexit.register(self.cleanup)
 
     def cleanup(self):
-        logging.debug('Server closing socket')
-        self.socket.close()
-
-    def onconnect(self, cb):
+        logging.debug('Server closing')
+        stores = {c.pages for c in self.clients} | {self.latest}
+        self.latest = None
+        for pages in stores - {None}:
+            pages.close()
+
+    # cb runs a scan, release is called when no more scans are waiting
+    def onconnect(self, cb, release=NOOP):
         self.launch = cb
+        self.release = release
 
     def listen(self):
-        self.socket.listen(5)
-        while True:
-            client = Client(*self.socket.accept())
-            client.process(self.launch)
-            client.cleanup()
+        asyncio.run(self._serve())
+
+    async def _serve(self):
+        self.queue = ScanQueue(self.launch, self.release, self.device)
+        self.scheduler = asyncio.ensure_future(self.queue.run())
+        server = None
+        while server is None:
+            try:
+                server = await asyncio.start_server(self._accept, port=self.port)
+            except OSError:
+                logging.info("Socket in use, trying again")
+                await asyncio.sleep(1)
+        logging.info('Server listening at port {}'.format(self.port))
+        async with server:
+            await server.serve_forever()
+
+    async def _accept(self, reader, writer):
+        client = Client(reader, writer, self)
+        self.clients.add(client)
+        try:
+            await client.process()
+        finally:
+            self.clients.discard(client)
+
+    async def scan(self, options, client_notify, alive):
+        success,pages = await self.queue.submit(options, client_notify, alive)
+        if success:
+            old,self.latest = self.latest,pages
+            self.release_pages(old)
+        else:
+            pages.close()
+        return success,pages
+
+    def release_pages(self, pages):
+        """close a page store once it is neither the latest scan nor any client's"""
+        if pages is None or pages is self.latest or any(c.pages is pages for c in self.clients):
+            return
+        pages.close()
+
+    def status(self):
+        return {
+            'scanning': self.queue.current is not None,
+            'queued': len(self.queue),
+            'clients': len(self.clients),
+            'pages': 0 if self.latest is None else len(self.latest),
+        }
 
 def cleanup_at_exit():
     signal(SIGTERM, lambda signum, stack_frame: sys.exit(1))
@@ -327,9 +608,10 @@ def cleanup_at_exit():
 
 def main():
     cleanup_at_exit()
+    metrics.serve()
     scanner = Scanner()
     server = Server(5555)
-    server.onconnect(scanner.scan)
+    server.onconnect(scanner.scan, scanner.release)
     server.listen()
 
 if __name__ == "__main__":
@@ -0,0 +1,95 @@
+"""
+Timelines of scans, shared by scingest and sccontrol (sccontrol/timeline.py links here).
+
+Both sides record spans of a scan under the id sccontrol sends with the
+scan command, {"scan": true, "id": "<scan id>", ...}, timed with their own
+clocks. Afterwards sccontrol measures how far scingest's clock is from its
+own with a few {"time": true} requests, takes scingest's spans with
+{"timeline": "<scan id>"}, and writes both, scingest's shifted onto its
+clock, as one trace in the Chrome trace format. That opens in
+chrome://tracing or https://ui.perfetto.dev, a track per thread.
+
+Spans recorded with no scan id are dropped, so code that is not part of
+a traced scan (benchmarks, scans from other clients) costs nothing.
+"""
+
+import json
+import time
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+KEEP = 8 # scans whose spans are kept until taken
+
+_scans = OrderedDict() # scan id -> spans, oldest first
+_lock = threading.Lock()
+
+
+def record(scan, name, start, end=None, **args):
+    """a span from start to end (now by default) on the calling thread"""
+    if scan is None:
+        return
+    span = {
+        'name': name,
+        'start': start,
+        'end': time.time() if end is None else end,
+        'thread': threading.current_thread().name,
+        'args': args,
+    }
+    with _lock:
+        if scan not in _scans:
+            _scans[scan] = []
+            while len(_scans) > KEEP:
+                _scans.popitem(last=False)
+        _scans[scan].append(span)
+
+@contextmanager
+def timed(scan, name, **args):
+    start = time.time()
+    try:
+        yield
+    finally:
+        record(scan, name, start, **args)
+
+def take(scan):
+    """the spans of a scan, forgetting them"""
+    with _lock:
+        return _scans.pop(scan, [])
+
+
+def clock_offset(samples):
+    """how far ahead the other clock is, from (sent, their time, received) samples
+
+    Their time is taken to be halfway through the round trip; the quickest
+    round trip leaves the least room for error.
+    """
+    sent,theirs,received = min(samples, key=lambda s: s[2]-s[0])
+    return theirs - (sent+received)/2
+
+def chrome_trace(processes):
+    """a Chrome trace of (process name, spans, clock offset) for each process"""
+    origin = min((s['start']-offset for _,spans,offset in processes for s in spans), default=0)
+    events = []
+    threads = {}
+    for pid,(process,spans,offset) in enumerate(processes, 1):
+        events.append({'name':'process_name', 'ph':'M', 'pid':pid, 'args':{'name':process}})
+        for span in spans:
+            key = (pid, span['thread'])
+            if key not in threads:
+                threads[key] = len(threads)+1
+                events.append({'name':'thread_name', 'ph':'M', 'pid':pid, 'tid':threads[key],
+                    'args':{'name':span['thread']}})
+            events.append({
+                'name': span['name'],
+                'ph': 'X',
+                'ts': round((span['start']-offset-origin)*1e6),
+                'dur': round((span['end']-span['start'])*1e6),
+                'pid': pid,
+                'tid': threads[key],
+                'args': span['args'],
+            })
+    return {'traceEvents':events, 'displayTimeUnit':'ms'}
+
+def write(path, processes):
+    with open(path, 'w') as f:
+        json.dump(chrome_trace(processes), f)
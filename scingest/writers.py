@@ -0,0 +1,181 @@
+import io
+import os
+import zlib
+import logging
+from PIL import TiffImagePlugin
+
+
+class Writer(object):
+    """Streams the pages of one scan to disk, encoding each once as it arrives
+
+    base is the output path without an extension.
+    """
+
+    extension = None
+
+    def __init__(self, base, dpi):
+        super(Writer, self).__init__()
+        self.base = base
+        self.dpi = dpi
+        self.files = []
+        self.pages = 0
+
+    def __enter__(self):
+        return self
+    def __exit__(self, *_):
+        self.close()
+
+    def write(self, page):
+        self._write(page)
+        self.pages += 1
+
+    def close(self):
+        pass
+
+    def size(self):
+        return sum(os.path.getsize(f) for f in self.files if os.path.exists(f))
+
+    def remove(self):
+        self.close()
+        for f in self.files:
+            try:
+                os.remove(f)
+            except OSError:
+                pass
+
+    def _write(self, page):
+        raise NotImplementedError
+
+
+class TiffWriter(Writer):
+    """One multi-page TIFF"""
+
+    extension = 'tiff'
+    # applied to each page as it is appended, so the file is
+    # finished as soon as the last page is
+    compression = 'tiff_adobe_deflate'
+
+    def __init__(self, base, dpi):
+        super(TiffWriter, self).__init__(base, dpi)
+        self.files.append('{}.{}'.format(base, self.extension))
+        logging.info("creating {}".format(self.files[0]))
+        self.tiff = TiffImagePlugin.AppendingTiffWriter(self.files[0], new=True)
+
+    def _write(self, page):
+        page.save(self.tiff, dpi=(self.dpi,self.dpi), compression=self.compression)
+        self.tiff.newFrame()
+
+    def close(self):
+        if self.tiff is not None:
+            self.tiff.close()
+            self.tiff = None
+
+
+class PdfWriter(Writer):
+    """One multi-page PDF, written an object at a time
+
+    Colour and gray pages are embedded as JPEG, lineart as deflated 1-bit
+    rows. The page tree and cross-reference table go at the end, so nothing
+    written earlier is ever revisited.
+    """
+
+    extension = 'pdf'
+    quality = 85
+
+    CATALOG = 1
+    PAGES = 2
+
+    def __init__(self, base, dpi):
+        super(PdfWriter, self).__init__(base, dpi)
+        self.files.append('{}.{}'.format(base, self.extension))
+        logging.info("creating {}".format(self.files[0]))
+        self.f = open(self.files[0], 'wb')
+        self.offsets = {} # object number -> file offset
+        self.next_obj = self.PAGES+1
+        self.kids = []
+        self.f.write(b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n')
+        self._object(self.CATALOG, b'<< /Type /Catalog /Pages 2 0 R >>')
+
+    def _object(self, num, body, stream=None):
+        self.offsets[num] = self.f.tell()
+        self.f.write('{} 0 obj\n'.format(num).encode('ascii'))
+        self.f.write(body)
+        if stream is not None:
+            self.f.write(b'\nstream\n')
+            self.f.write(stream)
+            self.f.write(b'\nendstream')
+        self.f.write(b'\nendobj\n')
+
+    def _encode(self, page):
+        if page.mode == '1':
+            return b'/DeviceGray /BitsPerComponent 1 /Filter /FlateDecode', zlib.compress(page.tobytes(), 6)
+        if page.mode not in ('L','RGB'):
+            page = page.convert('RGB')
+        buf = io.BytesIO()
+        page.save(buf, 'JPEG', quality=self.quality)
+        space = b'/DeviceGray' if page.mode == 'L' else b'/DeviceRGB'
+        return space + b' /BitsPerComponent 8 /Filter /DCTDecode', buf.getvalue()
+
+    def _write(self, page):
+        image,content,pg = range(self.next_obj, self.next_obj+3)
+        self.next_obj += 3
+        w,h = page.size
+        pw,ph = w*72.0/self.dpi, h*72.0/self.dpi
+        params,data = self._encode(page)
+        self._object(image, '<< /Type /XObject /Subtype /Image /Width {} /Height {} /ColorSpace '.format(w,h).encode('ascii')
+            + params + ' /Length {} >>'.format(len(data)).encode('ascii'), data)
+        draw = 'q {:.2f} 0 0 {:.2f} 0 0 cm /Im0 Do Q'.format(pw,ph).encode('ascii')
+        self._object(content, '<< /Length {} >>'.format(len(draw)).encode('ascii'), draw)
+        self._object(pg, ('<< /Type /Page /Parent {} 0 R /MediaBox [0 0 {:.2f} {:.2f}] '
+            '/Resources << /XObject << /Im0 {} 0 R >> >> /Contents {} 0 R >>').format(
+            self.PAGES, pw, ph, image, content).encode('ascii'))
+        self.kids.append(pg)
+
+    def close(self):
+        if self.f.closed:
+            return
+        kids = ' '.join('{} 0 R'.format(k) for k in self.kids)
+        self._object(self.PAGES, '<< /Type /Pages /Kids [{}] /Count {} >>'.format(kids, len(self.kids)).encode('ascii'))
+        xref = self.f.tell()
+        count = self.next_obj
+        self.f.write('xref\n0 {}\n0000000000 65535 f \n'.format(count).encode('ascii'))
+        for num in range(1, count):
+            self.f.write('{:010d} 00000 n \n'.format(self.offsets[num]).encode('ascii'))
+        self.f.write('trailer\n<< /Size {} /Root {} 0 R >>\nstartxref\n{}\n%%EOF\n'.format(
+            count, self.CATALOG, xref).encode('ascii'))
+        self.f.close()
+
+
+class ImageWriter(Writer):
+    """A separate image file per page"""
+
+    format = None
+    save_args = {}
+
+    def _write(self, page):
+        path = '{}-{:03d}.{}'.format(self.base, self.pages+1, self.extension)
+        logging.debug("creating {}".format(path))
+        self.files.append(path)
+        page.save(path, self.format, dpi=(self.dpi,self.dpi), **self.save_args)
+
+class PngWriter(ImageWriter):
+    extension = 'png'
+    format = 'PNG'
+    save_args = {'compress_level':1}
+
+class JpegWriter(ImageWriter):
+    extension = 'jpg'
+    format = 'JPEG'
+    save_args = {'quality':85}
+
+    def _write(self, page):
+        super(JpegWriter, self)._write(page if page.mode in ('L','RGB') else page.convert('L'))
+
+
+# output formats, as given in the scan options
+WRITERS = {
+    'tiff': TiffWriter,
+    'pdf': PdfWriter,
+    'png': PngWriter,
+    'jpeg': JpegWriter,
+}